@@ -1,16 +1,26 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import plotly.express as px
 import plotly.graph_objects as go
 import sqlite3
 import os
+import time
 from datetime import datetime
 import logging
 import traceback
 from threading import Lock
 
+import sucho_analytics
+import sucho_cache
+import sucho_db
+import sucho_export
+import sucho_matrix
+import sucho_pool
+import sucho_timing
+
 # Nastavení logování
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,90 +31,276 @@ st.set_page_config(page_title="Prohlížeč dat o suchu", layout="wide")
 # Konstanty
 SQL_FILE_PATH = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\Save\Output\pozemky_data.sql"
 DATABASE_NAME = "sucho_database.db"
-
-# Inicializace session state
-if 'conn' not in st.session_state:
-    st.session_state.conn = None
-    st.session_state.lock = Lock()
+# Maximální počet nabízených hodnot ve filtru, zbytek se najde hledáním
+OPTION_LIMIT = 1000
+# Počet uložených seznamů hodnot filtrů (kombinace sloupce, filtrů a hledání) a jejich platnost v sekundách;
+# záznamy starších verzí dat tak z cache vypadnou i bez nového hledání
+OPTION_CACHE_ENTRIES = 2000
+OPTION_CACHE_TTL = 3600
+# Paměť pro sdílenou cache výsledků dotazů a analýz (všechny relace dohromady)
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Nad tento počet pozemků ukazuje graf časového vývoje kvantilová pásma místo čáry pro každý pozemek
+LINE_LIMIT = 50
+# Maximální počet bodů jedné řady posílaný do prohlížeče
+MAX_CHART_POINTS = 400
+# Počet pozemků v žebříčku trendů v přehledu okresů
+TREND_LIMIT = 100
+# Maximální počet pozemků v heatmapě korelací
+CORRELATION_SAMPLE = 200
+# Počet pozemků v jednom bloku při sestavování souboru ke stažení
+EXPORT_CHUNK_ROWS = 5000
+# Počet čtecích spojení sdílených všemi relacemi
+POOL_SIZE = 8
+# Dump změněný před méně než tolika sekundami se považuje za rozepsaný
+DUMP_SETTLE_SECONDS = 5
+
+# Jediná cesta zápisu v procesu: import dumpu a zápis matice běží pod tímto zámkem
+WRITE_LOCK = Lock()
+
+@st.cache_resource
+def get_dump_state():
+    # Velikost a čas změny dumpu, ze kterého byla databáze naposledy připravena (sdíleno v procesu)
+    return {}
+
+def dump_signature():
+    try:
+        stat = os.stat(SQL_FILE_PATH)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
 
 def create_db_from_sql():
+    # Import nebo přestavba databáze z dumpu. Otisk obsahu (SHA-256) se počítá jen tehdy,
+    # když se od minula změnila velikost nebo čas změny souboru.
+    state = get_dump_state()
+    signature = dump_signature()
+    if state and (signature is None or state.get('signature') == signature):
+        return False
+    with WRITE_LOCK:
+        if state and state.get('signature') == signature:
+            return False
+        conn = sucho_db.build_database(SQL_FILE_PATH, DATABASE_NAME)
+        try:
+            sucho_matrix.write_matrix(conn, DATABASE_NAME)
+            sucho_db.ensure_parcel_trends(conn)
+        finally:
+            conn.close()
+        state['signature'] = signature
+    logger.info("Databáze připravena z SQL souboru")
+    return True
+
+def check_dump():
+    # Export bez database_path jen přegeneruje dump; běžící prohlížeč ho převezme při dalším požadavku.
+    # Soubor změněný před chvílí se ještě může zapisovat, počká se na další požadavek.
+    signature = dump_signature()
+    if signature is None or get_dump_state().get('signature') == signature:
+        return
+    if time.time() - signature[1] / 1e9 < DUMP_SETTLE_SECONDS:
+        return
     try:
-        conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False)
-        with open(SQL_FILE_PATH, 'r', encoding='utf-8') as sql_file:
-            sql_script = sql_file.read()
-        with st.session_state.lock:
-            conn.executescript(sql_script)
-        logger.info("Databáze úspěšně vytvořena z SQL souboru")
-        return conn
+        with sucho_timing.span('dump_reload'):
+            create_db_from_sql()
     except Exception as e:
-        logger.error(f"Chyba při vytváření databáze z SQL: {e}")
-        st.error(f"Nepodařilo se vytvořit databázi z SQL: {e}")
+        logger.warning(f"Nový SQL dump se nepodařilo načíst, zůstávají předchozí data: {e}")
+
+@st.cache_resource
+def get_pool():
+    # Databáze se připraví jednou pro proces, relace pak sdílejí čtecí spojení
+    create_db_from_sql()
+    return sucho_pool.ConnectionPool(DATABASE_NAME, POOL_SIZE)
+
+@st.cache_resource
+def get_result_cache():
+    return sucho_cache.ResultCache(CACHE_MAX_BYTES)
+
+@st.cache_resource(max_entries=2)
+def load_matrix(version):
+    # Matice namapovaná do paměti jednou pro proces a verzi dat. Chybějící matice je výjimka,
+    # ne None, aby se neuložila do cache a po dopsání nové verze se příště načetla.
+    # Starší verze se z cache vyřadí, jinak by jejich smazané soubory zůstaly namapované.
+    matrix = sucho_matrix.open_matrix(DATABASE_NAME, version)
+    if matrix is None:
+        raise FileNotFoundError(sucho_matrix.matrix_dir(DATABASE_NAME, version or ''))
+    return matrix
+
+def get_matrix(version):
+    # None znamená čtení přes SQL (matice pro tuto verzi ještě není zapsaná)
+    try:
+        return load_matrix(version)
+    except FileNotFoundError:
         return None
 
-@st.cache_data
-def get_unique_values(_conn, column, filters=None):
-    query = f"SELECT DISTINCT {column} FROM pozemky_data WHERE {column} IS NOT NULL AND {column} != ''"
-    params = []
-    if filters:
-        for key, values in filters.items():
-            if values:
-                query += f" AND {key} IN ({','.join(['?'] * len(values))})"
-                params.extend(values)
-    
+def refresh_data_version(pool):
+    # Po importu nových dat (i z přegenerovaného dumpu) se sdílená cache vyprázdní
+    check_dump()
+    with pool.connection() as conn:
+        version = sucho_db.data_version(conn)
+    get_result_cache().ensure_version(version)
+    return version
+
+def cached_result(kind, compute, filters, date_from, date_to, *extra):
+    cache = get_result_cache()
+    key = sucho_cache.make_key(kind, cache.version, filters, *date_window(date_from, date_to), *extra)
+    computed = []
+
+    def compute_once():
+        computed.append(True)
+        return compute()
+
+    with sucho_timing.span(f"cache_{kind}") as current:
+        value = cache.get_or_compute(key, compute_once)
+        current.record(hit=not computed)
+    return value
+
+@st.cache_data(max_entries=OPTION_CACHE_ENTRIES, ttl=OPTION_CACHE_TTL)
+def get_unique_values(_pool, column, filters=None, search='', limit=OPTION_LIMIT, version=None):
     try:
-        with st.session_state.lock:
-            df = pd.read_sql(query, _conn, params=params)
-        return sorted(df[column].tolist())
+        with sucho_timing.span('query_unique_values', column=column) as current, _pool.connection() as conn:
+            values = sucho_db.unique_values(conn, column, filters, search.strip(), limit)
+            current.record(rows=len(values))
+        return values
     except sqlite3.Error as e:
         logger.error(f"Chyba při získávání unikátních hodnot pro {column}: {e}")
         st.error(f"Nepodařilo se získat unikátní hodnoty pro {column}: {e}")
         return []
 
-def load_data(_conn, zkod_dpb=None, id_uz=None, ku_kod=None, okres_kod=None, date_from=None, date_to=None, drought_level=None):
-    query = "SELECT * FROM pozemky_data WHERE 1=1"
-    params = []
-
-    if zkod_dpb:
-        query += f" AND ZKOD_DPB IN ({','.join(['?']*len(zkod_dpb))})"
-        params.extend(zkod_dpb)
-    if id_uz:
-        query += f" AND ID_UZ IN ({','.join(['?']*len(id_uz))})"
-        params.extend(id_uz)
-    if ku_kod:
-        query += f" AND KU_KOD IN ({','.join(['?']*len(ku_kod))})"
-        params.extend(ku_kod)
-    if okres_kod:
-        query += f" AND OKRES_KOD IN ({','.join(['?']*len(okres_kod))})"
-        params.extend(okres_kod)
-
-    try:
-        with st.session_state.lock:
-            df = pd.read_sql(query, _conn, params=params)
-
-        if date_from and date_to:
-            date_from_str = date_from.strftime('%Y%m%d')
-            date_to_str = date_to.strftime('%Y%m%d')
-            m_columns = [col for col in df.columns if col.startswith('M_') and date_from_str <= col.split('_')[1] <= date_to_str]
-        else:
-            m_columns = [col for col in df.columns if col.startswith('M_')]
-
-        df = df[['ZKOD_DPB', 'ID_UZ', 'KU_KOD', 'OKRES_KOD'] + m_columns]
+def date_window(date_from, date_to):
+    # Rozsah dat se použije jen tehdy, když jsou zadané obě meze
+    if date_from and date_to:
+        return date_from, date_to
+    return None, None
+
+def can_use_summaries(zkod_dpb, id_uz, ku_kod, drought_level):
+    # Souhrnné tabulky jsou po okresech a datech, nelze z nich filtrovat pozemky ani průměrnou úroveň sucha
+    return not (zkod_dpb or id_uz or ku_kod) and (drought_level is None or drought_level >= 5.0)
+
+def query_data(pool, filters, date_from, date_to):
+    date_from, date_to = date_window(date_from, date_to)
+    matrix = get_matrix(get_result_cache().version)
+    df = None
+    if matrix is not None:
+        # Z databáze se čte jen seznam pozemků, hodnoty jsou řezem namapované matice
+        with sucho_timing.span('query_parcels') as current, pool.connection() as conn:
+            parcels = sucho_db.query_parcels(conn, filters)
+            current.record(rows=len(parcels))
+        with sucho_timing.span('matrix_slice') as current:
+            df = sucho_matrix.wide_frame(matrix, parcels, date_from, date_to)
+            if df is not None:
+                current.record(*sucho_timing.frame_size(df))
+    if df is None:
+        with sucho_timing.span('query_wide') as current, pool.connection() as conn:
+            df = sucho_db.query_wide(conn, filters, date_from, date_to)
+            current.record(*sucho_timing.frame_size(df))
+    m_columns = [col for col in df.columns if col.startswith('M_')]
+    df['mean'] = df[m_columns].mean(axis=1)
+    return df
 
-        for col in m_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+def load_data(pool, zkod_dpb=None, id_uz=None, ku_kod=None, okres_kod=None, date_from=None, date_to=None, drought_level=None):
+    filters = {'ZKOD_DPB': zkod_dpb, 'ID_UZ': id_uz, 'KU_KOD': ku_kod, 'OKRES_KOD': okres_kod}
 
-        df['mean'] = df[m_columns].mean(axis=1)
+    try:
+        # Načtená data jsou v cache bez prahu sucha, změna posuvníku nevyvolá nový dotaz
+        df = cached_result('data', lambda: query_data(pool, filters, date_from, date_to), filters, date_from, date_to)
 
         if drought_level is not None:
             df = df[df['mean'] <= drought_level]
 
         return df
-    except sqlite3.Error as e:
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
         logger.error(f"Chyba při načítání dat: {e}")
         st.error(f"Nepodařilo se načíst data: {e}")
         return pd.DataFrame()
 
-def visualize_data(df):
+def iter_export_frames(pool, matrix, filters, date_from, date_to, drought_level=None):
+    # Data ke stažení po blocích pozemků z matice (nebo z databáze), se stejnými sloupci a prahem jako zobrazená data
+    date_from, date_to = date_window(date_from, date_to)
+    with pool.connection() as conn:
+        parcels = sucho_db.query_parcels(conn, filters)
+    for start in range(0, len(parcels), EXPORT_CHUNK_ROWS):
+        chunk = parcels.iloc[start:start + EXPORT_CHUNK_ROWS]
+        df = sucho_matrix.wide_frame(matrix, chunk, date_from, date_to) if matrix is not None else None
+        if df is None:
+            with pool.connection() as conn:
+                df = sucho_db.query_wide(conn, filters, date_from, date_to, parcels=chunk)
+        df['mean'] = df[[col for col in df.columns if col.startswith('M_')]].mean(axis=1)
+        if drought_level is not None:
+            df = df[df['mean'] <= drought_level]
+        yield df
+
+def download_buttons(pool, filters, date_from, date_to, drought_level):
+    # Soubor se sestaví až po kliknutí na tlačítko; matice se převezme z aktuálního běhu skriptu
+    matrix = get_matrix(get_result_cache().version)
+
+    def prepare(fmt):
+        with sucho_timing.span('export_download', format=fmt) as current:
+            frames = iter_export_frames(pool, matrix, filters, date_from, date_to, drought_level)
+            download = sucho_export.download_file(frames, fmt)
+            current.record(nbytes=len(download))
+        return download
+
+    columns = st.columns(len(sucho_export.DOWNLOAD_FORMATS))
+    for column, (fmt, (label, extension, mime)) in zip(columns, sucho_export.DOWNLOAD_FORMATS.items()):
+        with column:
+            st.download_button(
+                label=f"Stáhnout data jako {label}",
+                data=lambda fmt=fmt: prepare(fmt),
+                file_name=f"sucho_data{extension}",
+                mime=mime,
+                on_click='ignore',
+                key=f"download_{fmt}",
+            )
+
+@sucho_timing.timed('prep_time_series')
+def time_series_figure(df, m_columns, top_n=10, selected=None):
+    dates = pd.to_datetime([col.split('_')[1] for col in m_columns], format='%Y%m%d')
+    values = df[m_columns].to_numpy(dtype='float64')
+    names = df['ZKOD_DPB'].astype(str).to_numpy()
+    fig = go.Figure()
+
+    if len(df) > LINE_LIMIT:
+        # Pásma přes všechny vybrané pozemky, bez převodu celé matice do dlouhého formátu
+        bands = sucho_analytics.quantile_bands(values)
+        idx = sucho_analytics.downsample_indices(bands['median'], MAX_CHART_POINTS)
+        x = dates[idx]
+        for upper, lower, name, color in (('max', 'min', 'Min-max', 'rgba(99, 110, 250, 0.15)'),
+                                          ('q75', 'q25', 'Kvartilové rozpětí', 'rgba(99, 110, 250, 0.35)')):
+            fig.add_trace(go.Scattergl(x=x, y=bands[upper][idx], mode='lines', line=dict(width=0),
+                                       showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scattergl(x=x, y=bands[lower][idx], mode='lines', line=dict(width=0),
+                                       fill='tonexty', fillcolor=color, name=name))
+        fig.add_trace(go.Scattergl(x=x, y=bands['median'][idx], mode='lines', name='Medián',
+                                   line=dict(color='rgb(99, 110, 250)', width=2)))
+
+    if selected:
+        # Pozemky vybrané uživatelem, nejvýše LINE_LIMIT čar
+        positions = np.flatnonzero(np.isin(names, list(selected)))[:LINE_LIMIT]
+    elif len(df) > LINE_LIMIT:
+        positions = df.reset_index(drop=True).nlargest(top_n, 'mean').index
+    else:
+        positions = range(len(df))
+
+    for pos in positions:
+        idx = sucho_analytics.downsample_indices(values[pos], MAX_CHART_POINTS)
+        fig.add_trace(go.Scattergl(x=dates[idx], y=values[pos][idx], mode='lines', name=names[pos]))
+
+    fig.update_layout(title='Časový vývoj sucha', xaxis_title='Datum', yaxis_title='Úroveň sucha',
+                      legend_title_text='ZKOD_DPB')
+    return fig
+
+@st.fragment
+def time_series_chart(df, m_columns, top_n):
+    # Fragment: změna vybraných pozemků překreslí jen graf, ne celý výběr dat
+    # Nabídka pozemků od nejsušších; už vybrané pozemky v ní zůstávají
+    ranked = df.sort_values('mean', ascending=False)['ZKOD_DPB'].astype(str).drop_duplicates()
+    options = ranked.head(OPTION_LIMIT).tolist()
+    selected = [value for value in st.session_state.get('line_parcels', []) if value not in options]
+    selected = st.multiselect('Pozemky v grafu (ZKOD_DPB):', selected + options, key='line_parcels',
+                              max_selections=LINE_LIMIT,
+                              help=f'Bez výběru se zobrazí nejsušší pozemky, nejvýše {LINE_LIMIT} čar.')
+    fig = time_series_figure(df, m_columns, top_n, selected)
+    st.plotly_chart(fig, use_container_width=True)
+
+def visualize_data(df, top_n=10):
     if df.empty:
         st.write("Žádná data k zobrazení.")
         return
@@ -113,18 +309,21 @@ def visualize_data(df):
     
     # Časový vývoj sucha
     st.subheader('Časový vývoj sucha')
-    df_long = df.melt(id_vars=['ZKOD_DPB'], value_vars=m_columns, var_name='date', value_name='drought_level')
-    df_long['date'] = pd.to_datetime(df_long['date'].str.split('_').str[1], format='%Y%m%d')
-    
-    fig = px.line(df_long, x='date', y='drought_level', color='ZKOD_DPB',
-                  labels={'date': 'Datum', 'drought_level': 'Úroveň sucha', 'ZKOD_DPB': 'ZKOD_DPB'},
-                  title='Časový vývoj sucha')
-    st.plotly_chart(fig, use_container_width=True)
-    st.write("""
+    time_series_chart(df, m_columns, top_n)
+    if len(df) > LINE_LIMIT:
+        st.write(f"""
+    Tento graf zobrazuje vývoj úrovně sucha v čase souhrnně pro {len(df)} vybraných pozemků.
+    - Osa X představuje časové období
+    - Osa Y představuje úroveň sucha (0-5, kde 5 je extrémní sucho)
+    - Plná čára je medián, tmavší pásmo kvartilové rozpětí a světlejší pásmo rozsah od minima po maximum
+    - Samostatné čáry ukazují pozemky vybrané nad grafem, bez výběru {min(top_n, len(df))} nejsušších pozemků
+    """)
+    else:
+        st.write("""
     Tento graf zobrazuje vývoj úrovně sucha v čase pro různé pozemky (ZKOD_DPB).
     - Osa X představuje časové období
     - Osa Y představuje úroveň sucha (0-5, kde 5 je extrémní sucho)
-    - Každá barevná čára reprezentuje jeden pozemek
+    - Každá barevná čára reprezentuje jeden pozemek, výběrem nad grafem lze zobrazit jen některé
     """)
 
     # Distribuce úrovně sucha
@@ -164,9 +363,75 @@ def visualize_data(df):
     - Chybové úsečky ukazují rozsah od minimální po maximální hodnotu v daném okrese
     """)
 
-def calculate_statistics(df):
+def visualize_summaries(pool, okres_kod, date_from, date_to):
+    date_from, date_to = date_window(date_from, date_to)
+    with sucho_timing.span('query_summaries') as current, pool.connection() as conn:
+        df_okres = sucho_db.district_summary(conn, okres_kod, date_from, date_to)
+        df_trend = sucho_db.date_summary(conn, okres_kod, date_from, date_to)
+        current.record(rows=len(df_okres) + len(df_trend))
+
+    if df_okres.empty:
+        st.warning("Žádná data k zobrazení. Zkuste upravit filtry.")
+        return
+
+    st.header('Přehled okresů')
+    total = (df_okres['mean'] * df_okres['count']).sum() / df_okres['count'].sum()
+    stats = {
+        'Průměrná úroveň sucha': round(total, 2),
+        'Počet okresů': len(df_okres),
+        'Nejsušší okres': df_okres.loc[df_okres['mean'].idxmax(), 'OKRES_KOD'],
+        'Nejvlhčí okres': df_okres.loc[df_okres['mean'].idxmin(), 'OKRES_KOD'],
+    }
+    st.dataframe(pd.DataFrame.from_dict(stats, orient='index', columns=['Hodnota']).astype(str))
+
+    st.subheader('Úroveň sucha podle okresů')
+    df_okres = df_okres.sort_values('mean', ascending=False)
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=df_okres['OKRES_KOD'], y=df_okres['mean'], name='Průměr denních hodnot',
+                         error_y=dict(type='data', symmetric=False,
+                                      array=df_okres['max']-df_okres['mean'],
+                                      arrayminus=df_okres['mean']-df_okres['min'])))
+    # Souhrnné tabulky mají denní minima a maxima, ne průměry pozemků jako detailní pohled
+    fig.update_layout(title='Průměrná úroveň sucha podle okresů s rozsahem denních hodnot',
+                      xaxis_title='Kód okresu',
+                      yaxis_title='Úroveň sucha',
+                      yaxis_range=[0, 5])
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader('Trend sucha v čase')
+    fig = px.line(df_trend, x='date', y='mean',
+                  labels={'date': 'Datum', 'mean': 'Průměrná úroveň sucha'},
+                  title='Trend sucha v čase')
+    st.plotly_chart(fig)
+
+    st.subheader('Pozemky s nejrychleji rostoucím suchem')
+    with sucho_timing.span('query_parcel_summary') as current, pool.connection() as conn:
+        df_rising = sucho_db.parcel_summary(conn, {'OKRES_KOD': okres_kod}, order_by='sen_slope', limit=TREND_LIMIT)
+        current.record(rows=len(df_rising))
+    st.dataframe(df_rising, hide_index=True)
+    st.write("""
+    Přehled je počítán ze souhrnných tabulek vytvořených při importu dat, bez načítání jednotlivých pozemků.
+    - Průměr okresu je průměrem všech denních hodnot pozemků v okrese za vybrané období
+    - Chybové úsečky ukazují nejnižší a nejvyšší denní hodnotu pozemku v okrese, ne rozsah průměrů pozemků
+      jako graf v detailu pozemků, a jsou proto širší
+    - Trendy pozemků (sen_slope, mk_z, longest_run, onset) jsou spočítány za celou sezónu při importu
+    - Pro detail jednotlivých pozemků zaškrtněte v postranním panelu 'Načíst data jednotlivých pozemků'
+    """)
+
+@sucho_timing.timed('prep_trends')
+def parcel_trend_table(df):
+    # Trendy všech načtených pozemků pro vybrané období, jedním vektorovým výpočtem nad maticí
     m_columns = [col for col in df.columns if col.startswith('M_')]
-    
+    dates = pd.to_datetime([col.split('_')[1] for col in m_columns], format='%Y%m%d')
+    days = dates.to_numpy().astype('datetime64[D]').astype(np.int64)
+    trends = sucho_analytics.parcel_trends(df[m_columns].to_numpy(), days)
+    onset = trends.pop('onset')
+    trends_df = pd.concat([df[['ZKOD_DPB', 'OKRES_KOD', 'mean']].reset_index(drop=True), pd.DataFrame(trends)], axis=1)
+    trends_df['onset'] = pd.Series(dates[np.maximum(onset, 0)]).where(onset >= 0) if len(dates) else pd.NaT
+    return trends_df.sort_values('sen_slope', ascending=False, na_position='last')
+
+@sucho_timing.timed('prep_statistics')
+def calculate_statistics(df, trends_df):
     stats = {
         'Průměrná úroveň sucha': df['mean'].mean(),
         'Medián úrovně sucha': df['mean'].median(),
@@ -174,7 +439,9 @@ def calculate_statistics(df):
         'Procento pozemků v kritickém suchu': (df['mean'] > 4).mean() * 100,
         'Nejsušší okres': df.groupby('OKRES_KOD')['mean'].mean().idxmax(),
         'Nejvlhčí okres': df.groupby('OKRES_KOD')['mean'].mean().idxmin(),
-        'Trend sucha': 'Rostoucí' if df[m_columns].mean().is_monotonic_increasing else 'Klesající'
+        'Trend sucha': 'Rostoucí' if trends_df['sen_slope'].median() > 0 else 'Klesající',
+        'Pozemky s významně rostoucím suchem': (trends_df['mk_z'] > sucho_analytics.SIGNIFICANT_Z).sum(),
+        'Pozemky s významně klesajícím suchem': (trends_df['mk_z'] < -sucho_analytics.SIGNIFICANT_Z).sum(),
     }
     
     stats_df = pd.DataFrame.from_dict(stats, orient='index', columns=['Hodnota'])
@@ -194,7 +461,8 @@ def display_statistics(stats_df):
     - Procento pozemků v kritickém suchu: Jaké procento pozemků je v kritickém suchu.
     - Nejsušší okres: Okres s nejvyšší průměrnou úrovní sucha.
     - Nejvlhčí okres: Okres s nejnižší průměrnou úrovní sucha.
-    - Trend sucha: Zda úroveň sucha celkově roste nebo klesá v průběhu času.
+    - Trend sucha: Zda úroveň sucha celkově roste nebo klesá v průběhu času (medián Senova sklonu pozemků).
+    - Pozemky s významně rostoucím / klesajícím suchem: Počet pozemků, jejichž trend je podle Mann-Kendallova testu významný na hladině 5 %.
     """)
 
     # Interpretace výsledků
@@ -212,25 +480,83 @@ def display_statistics(stats_df):
       {"zhoršuje" if trend == "Rostoucí" else "zlepšuje"} v průběhu času.
     """)
 
-def analyze_drought_days(df):
+def display_parcel_trends(trends_df):
+    st.subheader('Trend sucha podle pozemků')
+    st.dataframe(trends_df.rename(columns={
+        'mean': 'Průměr',
+        'slope': 'Sklon (OLS) za den',
+        'sen_slope': 'Senův sklon za den',
+        'mk_z': 'Mann-Kendall z',
+        'longest_run': 'Nejdelší řada dní > 4',
+        'onset': 'Začátek kritického sucha',
+    }), hide_index=True)
+    st.write("""
+    Tabulka je seřazena podle Senova sklonu, pozemky s nejrychleji rostoucím suchem jsou nahoře. Kliknutím na záhlaví lze řadit podle jiného ukazatele.
+    - Sklon (OLS) a Senův sklon: Změna úrovně sucha za den podle lineární regrese a podle mediánu sklonů všech dvojic dat (odolný vůči odchylkám).
+    - Mann-Kendall z: Síla monotónního trendu; hodnota nad 1,96 znamená významně rostoucí sucho, pod -1,96 významně klesající.
+    - Nejdelší řada dní > 4: Nejvíce po sobě jdoucích měření v kritickém suchu.
+    - Začátek kritického sucha: První datum, kdy pozemek překročil kritickou úroveň 4.
+    """)
+
+@sucho_timing.timed('prep_normalize')
+def normalize_parcels(df):
+    return sucho_analytics.normalize_series(df[[col for col in df.columns if col.startswith('M_')]].to_numpy())
+
+@sucho_timing.timed('prep_correlation')
+def clustered_correlation(normalized, names):
+    # Korelace jen na omezeném vzorku pozemků, seřazená spektrálním shlukováním
+    rows = sucho_analytics.sample_rows(len(normalized), CORRELATION_SAMPLE)
+    sample = normalized[rows]
+    correlation = sample @ sample.T
+    order = sucho_analytics.cluster_order(correlation)
+    labels = names[rows][order]
+    return pd.DataFrame(correlation[np.ix_(order, order)], index=labels, columns=labels)
+
+@st.fragment
+def parcel_similarity(normalized, names, default_name):
+    # Fragment: změna pozemku přepočítá jen tuto část, ne celý výběr dat
+    st.subheader('Podobné pozemky')
+    name = st.text_input('ZKOD_DPB pozemku:', value=str(default_name), key='similar_to')
+    k = st.number_input('Počet podobných pozemků:', 1, 100, 10, key='similar_k')
+    rows = np.flatnonzero(names == name)
+    if not len(rows):
+        st.warning(f"Pozemek {name} není mezi načtenými pozemky.")
+        return
+    indices, scores = sucho_analytics.top_k_similar(normalized, rows[:1], k)
+    st.dataframe(pd.DataFrame({'ZKOD_DPB': names[indices[0]], 'Korelace': scores[0]}), hide_index=True)
+    st.write("""
+    Pozemky s nejpodobnějším průběhem sucha ve vybraném období (Pearsonova korelace denních hodnot).
+    """)
+
+@sucho_timing.timed('prep_drought_days')
+def drought_day_counts(df):
+    # Třídy sucha se přiřadí jedním průchodem maticí, rozpady podle okresu a měsíce jsou součty počtů pozemků a dat
     m_columns = [col for col in df.columns if col.startswith('M_')]
-    
-    drought_levels = {
-        'Normální stav (0-1)': (0, 1),
-        'Mírné sucho (1-2)': (1, 2),
-        'Střední sucho (2-3)': (2, 3),
-        'Vážné sucho (3-4)': (3, 4),
-        'Extrémní sucho (4-5)': (4, 5)
+    by_parcel, by_date = sucho_analytics.class_histograms(df[m_columns].to_numpy())
+    classes = list(sucho_analytics.DROUGHT_CLASSES)
+
+    results_df = pd.DataFrame({'Počet dnů': by_parcel.sum(axis=0)}, index=classes)
+
+    districts, district_counts = sucho_analytics.group_counts(by_parcel, df['OKRES_KOD'].astype(str).to_numpy())
+    district_df = pd.DataFrame(district_counts, index=pd.Index(districts, name='OKRES_KOD'), columns=classes)
+
+    months = [col.split('_')[1][:6] for col in m_columns]
+    months, month_counts = sucho_analytics.group_counts(by_date, months) if m_columns else ([], by_date)
+    month_df = pd.DataFrame(month_counts, columns=classes,
+                            index=pd.Index(pd.to_datetime(list(months), format='%Y%m'), name='Měsíc'))
+
+    parcel_df = pd.concat([df[['ZKOD_DPB', 'OKRES_KOD']].reset_index(drop=True),
+                           pd.DataFrame(by_parcel, columns=classes)], axis=1)
+
+    return {
+        'total': results_df.sort_values('Počet dnů', ascending=False),
+        'okres': district_df,
+        'mesic': month_df,
+        'pozemek': parcel_df,
     }
-    
-    results = {}
-    for level, (min_val, max_val) in drought_levels.items():
-        days = ((df[m_columns] > min_val) & (df[m_columns] <= max_val)).sum().sum()
-        results[level] = days
-    
-    results_df = pd.DataFrame.from_dict(results, orient='index', columns=['Počet dnů'])
-    results_df = results_df.sort_values('Počet dnů', ascending=False)
-    
+
+def analyze_drought_days(counts):
+    results_df = counts['total']
     st.subheader('Analýza počtu dnů s různými úrovněmi sucha')
     st.dataframe(results_df)
     
@@ -244,44 +570,82 @@ def analyze_drought_days(df):
     To poskytuje přehled o tom, jak často se vyskytují různé úrovně sucha.
              """)
 
+    tab_district, tab_month, tab_parcel = st.tabs(['Podle okresu', 'Podle měsíce', 'Podle pozemku'])
+    with tab_district:
+        st.dataframe(counts['okres'])
+    with tab_month:
+        month_df = counts['mesic']
+        fig = px.bar(month_df, x=month_df.index, y=month_df.columns,
+                     labels={'x': 'Měsíc', 'value': 'Počet dnů', 'variable': 'Úroveň sucha'},
+                     title='Počet dnů s různými úrovněmi sucha podle měsíce')
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(month_df)
+    with tab_parcel:
+        st.dataframe(counts['pozemek'])
+
+def diagnostics_panel(trace):
+    # Skrytý panel: zobrazí se jen s parametrem ?diagnostics=1 v adrese
+    with st.sidebar.expander('Diagnostika', expanded=True):
+        spans = pd.DataFrame(sucho_timing.recent_spans(trace))
+        if not spans.empty:
+            leading = ['path', 'duration_ms', 'rows', 'bytes']
+            spans = spans[leading + [col for col in spans.columns if col not in leading + ['span', 'trace']]]
+        st.dataframe(spans, hide_index=True)
+        st.json(get_result_cache().stats())
+        report = sucho_timing.recent_profile(trace)
+        if report:
+            st.code(report)
+        st.caption('Profilování zapnete proměnnými prostředí SUCHO_PROFILE=1 (cProfile) a SUCHO_TRACEMALLOC=1 (paměť).')
+
 def main():
+    # Každý běh skriptu je jeden úsek; dílčí dotazy a přípravy grafů jsou jeho potomci
+    with sucho_timing.profiled('dashboard_request') as request:
+        render_dashboard()
+    if st.query_params.get('diagnostics') == '1':
+        diagnostics_panel(request.trace)
+
+def render_dashboard():
     st.title('Prohlížeč dat o suchu')
     st.sidebar.image("http://agropocasi.cz/wp-content/uploads/2022/11/Logo-45.png", use_column_width=True)
 
     try:
-        # Vytvoření nebo připojení k databázi
-        if st.session_state.conn is None:
+        # Vytvoření databáze (jednou pro proces) a sdílená čtecí spojení
+        try:
             with st.spinner('Vytváření databáze ze SQL souboru...'):
-                st.session_state.conn = create_db_from_sql()
-        
-        if st.session_state.conn is None:
+                pool = get_pool()
+        except Exception as e:
+            logger.error(f"Chyba při vytváření databáze z SQL: {e}")
+            st.error(f"Nepodařilo se vytvořit databázi z SQL: {e}")
             st.error("Nepodařilo se vytvořit spojení s databází. Aplikace nemůže pokračovat.")
             return
 
+        data_version = refresh_data_version(pool)
+
         st.sidebar.header('Filtry')
         
-        def selectbox_with_search(label, options, key):
+        def selectbox_with_search(label, column, filters, key):
+            # Hledání podle začátku hodnoty probíhá v databázi, ne nad seznamem v Pythonu
             search = st.sidebar.text_input(f"Hledat {label}", key=f"search_{key}")
-            filtered_options = [opt for opt in options if search.lower() in str(opt).lower()]
-            return st.sidebar.multiselect(label, filtered_options, key=key)
+            options = get_unique_values(pool, column, filters, search, version=data_version)
+            if len(options) >= OPTION_LIMIT:
+                st.sidebar.caption(f"Zobrazeno prvních {OPTION_LIMIT} hodnot, upřesněte hledání.")
+            # Už vybrané hodnoty musí zůstat v nabídce, i když neodpovídají hledání
+            selected = [value for value in st.session_state.get(key, []) if value not in options]
+            return st.sidebar.multiselect(label, selected + options, key=key)
 
         filters = {}
         
         with st.spinner('Načítání možností filtrů...'):
-            zkod_dpb_options = get_unique_values(st.session_state.conn, 'ZKOD_DPB', filters)
-            zkod_dpb = selectbox_with_search('ZKOD_DPB:', zkod_dpb_options, 'zkod_dpb')
+            zkod_dpb = selectbox_with_search('ZKOD_DPB:', 'ZKOD_DPB', filters, 'zkod_dpb')
             filters['ZKOD_DPB'] = zkod_dpb
 
-            id_uz_options = get_unique_values(st.session_state.conn, 'ID_UZ', filters)
-            id_uz = selectbox_with_search('ID_UZ:', id_uz_options, 'id_uz')
+            id_uz = selectbox_with_search('ID_UZ:', 'ID_UZ', filters, 'id_uz')
             filters['ID_UZ'] = id_uz
 
-            ku_kod_options = get_unique_values(st.session_state.conn, 'KU_KOD', filters)
-            ku_kod = selectbox_with_search('KU_KOD:', ku_kod_options, 'ku_kod')
+            ku_kod = selectbox_with_search('KU_KOD:', 'KU_KOD', filters, 'ku_kod')
             filters['KU_KOD'] = ku_kod
 
-            okres_kod_options = get_unique_values(st.session_state.conn, 'OKRES_KOD', filters)
-            okres_kod = selectbox_with_search('OKRES_KOD:', okres_kod_options, 'okres_kod')
+            okres_kod = selectbox_with_search('OKRES_KOD:', 'OKRES_KOD', filters, 'okres_kod')
         
         col1, col2 = st.sidebar.columns(2)
         with col1:
@@ -290,22 +654,26 @@ def main():
             date_to = st.date_input('Do data:', min_value=datetime(1900, 1, 1), max_value=datetime.now())
         
         drought_level = st.sidebar.slider('Maximální úroveň sucha:', 0.0, 5.0, 5.0, 0.1)
-
-        if st.sidebar.button('Filtrovat a zobrazit', key='filter_button'):
+        detail_data = st.sidebar.checkbox('Načíst data jednotlivých pozemků', value=False,
+                                          help='Bez výběru pozemků, uživatelů a katastrů se jinak zobrazí rychlý přehled okresů.')
+        summaries = can_use_summaries(zkod_dpb, id_uz, ku_kod, drought_level)
+        top_n = st.sidebar.number_input('Počet zvýrazněných nejsušších pozemků v grafu:', 0, 50, 10)
+
+        filter_clicked = st.sidebar.button('Filtrovat a zobrazit', key='filter_button')
+        if filter_clicked and summaries and not detail_data:
+            with st.spinner('Načítání přehledu okresů...'):
+                visualize_summaries(pool, okres_kod, date_from, date_to)
+
+        elif filter_clicked:
+            selection = {'ZKOD_DPB': zkod_dpb, 'ID_UZ': id_uz, 'KU_KOD': ku_kod, 'OKRES_KOD': okres_kod}
             with st.spinner('Načítání a zpracování dat...'):
-                df = load_data(st.session_state.conn, zkod_dpb, id_uz, ku_kod, okres_kod, date_from, date_to, drought_level)
+                df = load_data(pool, zkod_dpb, id_uz, ku_kod, okres_kod, date_from, date_to, drought_level)
             
             if not df.empty:
                 st.success(f'Načteno {len(df)} záznamů.')
                 
-                # Příprava dat pro stažení
-                csv = df.to_csv(index=False)
-                st.download_button(
-                    label="Stáhnout data jako CSV",
-                    data=csv,
-                    file_name="sucho_data.csv",
-                    mime="text/csv",
-                )
+                # Stažení dat: soubor se vytvoří po blocích až při kliknutí
+                download_buttons(pool, selection, date_from, date_to, drought_level)
 
                 # Zobrazení filtrovaných dat
                 with st.expander("Zobrazit filtrovaná data"):
@@ -313,15 +681,20 @@ def main():
 
                 # Vizualizace dat
                 st.header('Vizualizace dat')
-                visualize_data(df)
+                visualize_data(df, top_n)
 
                 # Statistiky
                 st.header('Statistiky sucha')
-                stats_df = calculate_statistics(df)
+                trends_df = cached_result('trends', lambda: parcel_trend_table(df),
+                                          selection, date_from, date_to, drought_level)
+                stats_df = cached_result('statistics', lambda: calculate_statistics(df, trends_df),
+                                         selection, date_from, date_to, drought_level)
                 display_statistics(stats_df)
+                display_parcel_trends(trends_df)
 
                 # Analýza počtu dnů s různými úrovněmi sucha
-                analyze_drought_days(df)
+                analyze_drought_days(cached_result('drought_days', lambda: drought_day_counts(df),
+                                                   selection, date_from, date_to, drought_level))
 
                 # Další analýzy
                 st.header('Další analýzy')
@@ -333,27 +706,39 @@ def main():
 
                 # Trend sucha v čase
                 st.subheader('Trend sucha v čase')
-                df_trend = df.melt(id_vars=['ZKOD_DPB'], 
-                                   value_vars=[col for col in df.columns if col.startswith('M_')], 
-                                   var_name='date', value_name='drought_level')
-                df_trend['date'] = pd.to_datetime(df_trend['date'].str.split('_').str[1], format='%Y%m%d')
-                df_trend = df_trend.groupby('date')['drought_level'].mean().reset_index()
+                with sucho_timing.span('prep_trend_chart', summaries=summaries):
+                    if summaries:
+                        with pool.connection() as conn:
+                            df_trend = sucho_db.date_summary(conn, okres_kod, *date_window(date_from, date_to))
+                        df_trend = df_trend.rename(columns={'mean': 'drought_level'})
+                    else:
+                        # Průměr každého sloupce data přímo nad maticí, bez převodu do dlouhého formátu
+                        df_trend = df[[col for col in df.columns if col.startswith('M_')]].mean().rename('drought_level').reset_index()
+                        df_trend['date'] = pd.to_datetime(df_trend['index'].str.split('_').str[1], format='%Y%m%d')
                 fig = px.line(df_trend, x='date', y='drought_level',
                               labels={'date': 'Datum', 'drought_level': 'Průměrná úroveň sucha'},
                               title='Trend sucha v čase')
                 st.plotly_chart(fig)
 
                 # Korelace mezi pozemky
+                normalized = cached_result('normalized', lambda: normalize_parcels(df),
+                                           selection, date_from, date_to, drought_level)
+                names = df['ZKOD_DPB'].astype(str).to_numpy()
+                parcel_similarity(normalized, names, df.loc[df['mean'].idxmax(), 'ZKOD_DPB'])
+
                 st.subheader('Korelace mezi pozemky')
-                corr_matrix = df[[col for col in df.columns if col.startswith('M_')]].corr()
+                corr_matrix = cached_result('correlation', lambda: clustered_correlation(normalized, names),
+                                            selection, date_from, date_to, drought_level)
                 fig = px.imshow(corr_matrix, 
                                 labels=dict(color="Korelace"),
+                                zmin=-1, zmax=1,
                                 title="Heatmapa korelací mezi pozemky")
                 st.plotly_chart(fig)
-                st.write("""
+                st.write(f"""
                 Tato heatmapa ukazuje korelace mezi úrovněmi sucha na různých pozemcích. 
                 Tmavší barvy indikují silnější korelaci (podobný průběh sucha), 
                 světlejší barvy indikují slabší korelaci (odlišný průběh sucha).
+                Pozemky jsou seřazeny tak, aby podobné ležely vedle sebe; při více než {CORRELATION_SAMPLE} pozemcích se zobrazí náhodný vzorek.
                 """)
 
             else:
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Zodpovídání otázek nad články pro meta-analýzu. Segmenty z rozpoznání layoutu se ukládají
+# podle SHA-256 PDF, takže se extrakce pro stejný soubor neopakuje. Text se rozdělí na úseky
+# a pro každou otázku se lokálním BM25 indexem vyberou nejrelevantnější úseky místo ořezu na začátek.
+# Kontext dokumentu se modelem zakóduje jednou a jeho KV cache se použije pro všechny otázky.
+
+SEGMENT_CACHE_DIR = "segment_cache"
+# Zvýšit při změně extrakce segmentů, starší cache se pak přestane používat
+SEGMENT_CACHE_VERSION = 1
+CHUNK_WORDS = 120
+CHUNKS_PER_QUESTION = 3
+# Úseky ze začátku článku (název, autoři, afiliace) se do kontextu berou vždy
+LEAD_CHUNKS = 1
+MAX_CONTEXT_TOKENS = 3072
+MAX_NEW_TOKENS = 50
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_segments(pdf_path, extract, cache_dir=SEGMENT_CACHE_DIR):
+    # Segmenty (typ, text) z cache podle obsahu PDF, jinak extract(pdf_path) a uložení
+    cache_path = os.path.join(cache_dir, f"{file_sha256(pdf_path)}_v{SEGMENT_CACHE_VERSION}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            segments = [tuple(segment) for segment in json.load(f)]
+        logger.info(f"Segmenty {pdf_path} načteny z cache ({len(segments)})")
+        return segments
+
+    segments = [(segment_type, text) for segment_type, text in extract(pdf_path)]
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(segments, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Segmenty {pdf_path} extrahovány ({len(segments)})")
+    return segments
+
+
+def split_chunks(segments, max_words=CHUNK_WORDS):
+    # Úseky do max_words slov v pořadí dokumentu; každý nese nadpis své sekce, aby dával smysl i samostatně
+    chunks = []
+    title = None
+    words = []
+
+    def flush():
+        if words:
+            header = f"Title: {title}\n" if title else ""
+            chunks.append(header + " ".join(words))
+            words.clear()
+
+    for segment_type, text in segments:
+        text = text.strip()
+        if not text:
+            continue
+        if segment_type == "Title":
+            flush()
+            title = " ".join(text.split())
+            continue
+        for word in text.split():
+            words.append(word)
+            if len(words) >= max_words:
+                flush()
+    flush()
+    return chunks
+
+
+def tokenize(text):
+    return _WORD_RE.findall(text.lower())
+
+
+class ChunkIndex:
+    # BM25 nad úseky jednoho dokumentu, bez externích závislostí
+
+    def __init__(self, chunks, k1=BM25_K1, b=BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._terms = [Counter(tokenize(chunk)) for chunk in chunks]
+        self._lengths = [sum(terms.values()) for terms in self._terms]
+        self._average_length = sum(self._lengths) / len(self._lengths) if chunks else 0.0
+        document_frequency = Counter(term for terms in self._terms for term in terms)
+        n = len(chunks)
+        self._idf = {term: math.log(1.0 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    def scores(self, query):
+        query_terms = [term for term in set(tokenize(query)) if term in self._idf]
+        result = []
+        for terms, length in zip(self._terms, self._lengths):
+            norm = self.k1 * (1.0 - self.b + self.b * length / self._average_length) if self._average_length else self.k1
+            score = 0.0
+            for term in query_terms:
+                tf = terms.get(term, 0)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1.0) / (tf + norm)
+            result.append(score)
+        return result
+
+    def search(self, query, k):
+        # Indexy k nejlepších úseků s kladným skóre, při shodě dřívější úsek
+        scores = self.scores(query)
+        ranked = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: (-scores[i], i))
+        return ranked[:k]
+
+
+class DocumentQA:
+    # Odpovědi na sadu otázek nad jedním dokumentem: společný prefix (instrukce + kontext) se zakóduje
+    # jednou, pro každou otázku se dogeneruje jen její text a odpověď a cache se pak zkrátí zpět na prefix.
+
+    def __init__(self, tokenizer, model, device=None, max_context_tokens=MAX_CONTEXT_TOKENS,
+                 max_new_tokens=MAX_NEW_TOKENS, chunks_per_question=CHUNKS_PER_QUESTION,
+                 chunk_words=CHUNK_WORDS, lead_chunks=LEAD_CHUNKS):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device if device is not None else model.device
+        self.max_context_tokens = max_context_tokens
+        self.max_new_tokens = max_new_tokens
+        self.chunks_per_question = chunks_per_question
+        self.chunk_words = chunk_words
+        self.lead_chunks = lead_chunks
+
+    def _token_counts(self, texts):
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+    def select_context(self, chunks, questions):
+        # Úvodní úseky a pak po kolech nejlepší úsek každé otázky, dokud se vejdou do rozpočtu tokenů;
+        # vybrané úseky se vrátí v pořadí dokumentu
+        index = ChunkIndex(chunks)
+        rankings = [index.search(question, self.chunks_per_question) for question in questions]
+        candidates = list(range(min(self.lead_chunks, len(chunks))))
+        for rank in range(self.chunks_per_question):
+            candidates.extend(ranking[rank] for ranking in rankings if rank < len(ranking))
+
+        counts = self._token_counts(chunks)
+        selected = set()
+        used = 0
+        for i in candidates:
+            if i in selected or used + counts[i] > self.max_context_tokens:
+                continue
+            selected.add(i)
+            used += counts[i]
+        return [chunks[i] for i in sorted(selected)]
+
+    def build_prefix(self, instructions, context_chunks):
+        context = "\n\n".join(context_chunks)
+        return f"{instructions}\n\nContext:\n{context}\n\n" if instructions else f"Context:\n{context}\n\n"
+
+    @staticmethod
+    def build_question(question):
+        return f"Question: {question}\nAnswer:"
+
+    def answer(self, segments, questions, instructions=""):
+        import torch
+
+        chunks = split_chunks(segments, self.chunk_words)
+        context_chunks = self.select_context(chunks, list(questions.values()))
+        prefix = self.build_prefix(instructions, context_chunks)
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+
+        answers = {}
+        with torch.no_grad():
+            prefix_ids = self.tokenizer(prefix, return_tensors='pt')['input_ids'].to(self.device)
+            prefix_length = prefix_ids.shape[1]
+            cache = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+            logger.info(f"Kontext: {len(context_chunks)}/{len(chunks)} úseků, {prefix_length} tokenů")
+
+            for key, question in questions.items():
+                question_ids = self.tokenizer(self.build_question(question), add_special_tokens=False,
+                                              return_tensors='pt')['input_ids'].to(self.device)
+                input_ids = torch.cat([prefix_ids, question_ids], dim=1)
+                outputs = self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                              past_key_values=cache, max_new_tokens=self.max_new_tokens,
+                                              do_sample=False, pad_token_id=pad_token_id)
+                # generate doplní do cache otázku i odpověď, další otázka pokračuje jen od prefixu
+                generated = cache.get_seq_length() - prefix_length
+                if generated > 0:
+                    cache.crop(-generated)
+                answer = self.tokenizer.decode(outputs[0, input_ids.shape[1]:], skip_special_tokens=True)
+                answers[key] = answer.strip().split("\n")[0]
+        return answers
+
+
+def answer_documents(documents, questions, qa, instructions=""):
+    # documents: {název: segmenty}; vrací {název: {klíč otázky: odpověď}}
+    all_answers = {}
+    for i, (name, segments) in enumerate(documents.items(), start=1):
+        logger.info(f"Dokument {i}/{len(documents)}: {name}")
+        all_answers[name] = qa.answer(segments, questions, instructions)
+    return all_answers
@@ -0,0 +1,232 @@
+import warnings
+
+import numpy as np
+
+BAND_QUANTILES = (0.0, 0.25, 0.5, 0.75, 1.0)
+BAND_NAMES = ('min', 'q25', 'median', 'q75', 'max')
+
+
+def quantile_bands(values):
+    # Kvantily přes všechny pozemky pro každé datum v jednom průchodu (values: pozemky x data)
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[0] == 0:
+        return {name: np.full(values.shape[1], np.nan) for name in BAND_NAMES}
+    with warnings.catch_warnings():
+        # Datum bez jediné hodnoty dává NaN, varování je zbytečné
+        warnings.simplefilter('ignore', RuntimeWarning)
+        quantiles = np.nanquantile(values, BAND_QUANTILES, axis=0)
+    return dict(zip(BAND_NAMES, quantiles))
+
+
+def downsample_indices(series, max_points):
+    # Min/max v každém úseku řady: zachová špičky a poklesy při zlomku bodů
+    series = np.asarray(series, dtype=np.float64)
+    n = len(series)
+    if n <= max_points or max_points < 4:
+        return np.arange(n)
+
+    buckets = max_points // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    filled_low = np.where(np.isnan(series), np.inf, series)
+    filled_high = np.where(np.isnan(series), -np.inf, series)
+    indices = [0, n - 1]
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            indices.append(start + int(np.argmin(filled_low[start:stop])))
+            indices.append(start + int(np.argmax(filled_high[start:stop])))
+    return np.unique(indices)
+
+
+DROUGHT_CLASSES = (
+    'Normální stav (0-1)',
+    'Mírné sucho (1-2)',
+    'Střední sucho (2-3)',
+    'Vážné sucho (3-4)',
+    'Extrémní sucho (4-5)',
+)
+# Hranice tříd: třída i obsahuje hodnoty v intervalu (CLASS_EDGES[i], CLASS_EDGES[i + 1]]
+CLASS_EDGES = np.arange(len(DROUGHT_CLASSES) + 1, dtype=np.float64)
+
+
+def drought_classes(values):
+    # Jedno binování celé matice; hodnoty mimo (0, 5] a NaN dostanou třídu -1
+    values = np.asarray(values, dtype=np.float64)
+    classes = np.searchsorted(CLASS_EDGES, values, side='left') - 1
+    classes[(classes < 0) | (classes >= len(DROUGHT_CLASSES))] = -1
+    return classes.astype(np.int8)
+
+
+def class_histograms(values):
+    # Počty tříd pro každý pozemek a každé datum z jednoho průchodu (values: pozemky x data).
+    # Vrací (by_parcel, by_date) s tvary pozemky x třídy a data x třídy.
+    classes = drought_classes(values)
+    n_parcels, n_dates = classes.shape
+    n_classes = len(DROUGHT_CLASSES)
+    valid = classes >= 0
+    parcel_index, date_index = np.nonzero(valid)
+    class_index = classes[valid].astype(np.int64)
+    by_parcel = np.bincount(parcel_index * n_classes + class_index,
+                            minlength=n_parcels * n_classes).reshape(n_parcels, n_classes)
+    by_date = np.bincount(date_index * n_classes + class_index,
+                          minlength=n_dates * n_classes).reshape(n_dates, n_classes)
+    return by_parcel, by_date
+
+
+def group_counts(counts, labels):
+    # Sečte řádky počtů se stejným štítkem (okres, měsíc); vrací seřazené štítky a součty
+    groups, inverse = np.unique(np.asarray(labels), return_inverse=True)
+    summed = np.zeros((len(groups), counts.shape[1]), dtype=counts.dtype)
+    np.add.at(summed, inverse.ravel(), counts)
+    return groups, summed
+
+
+CRITICAL_LEVEL = 4
+# Počet dvojic (pozemek, dvojice dat) v jednom bloku Mann-Kendall/Sen; omezuje paměť na ~32 MB float64
+TREND_BLOCK_PAIRS = 4_000_000
+TREND_COLUMNS = ('slope', 'sen_slope', 'mk_z', 'longest_run', 'onset')
+# Hranice |z| pro trend významný na hladině 5 %
+SIGNIFICANT_Z = 1.96
+
+
+def _ols_slope(values, days):
+    # Sklon přímky nejmenších čtverců pro každý řádek, chybějící hodnoty se vynechají
+    valid = ~np.isnan(values)
+    x = np.where(valid, days, 0.0)
+    y = np.where(valid, values, 0.0)
+    n = valid.sum(axis=1)
+    sx, sy = x.sum(axis=1), y.sum(axis=1)
+    denominator = n * (x * x).sum(axis=1) - sx * sx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * (x * y).sum(axis=1) - sx * sy) / denominator
+    return np.where((n >= 2) & (denominator > 0), slope, np.nan)
+
+
+def _mann_kendall_sen(values, days, block_pairs):
+    # Statistika S Mann-Kendallova testu a Senův sklon přes všechny dvojice dat,
+    # po blocích pozemků, aby matice rozdílů (blok x dvojice) nepřerostla paměť
+    n_parcels, n_dates = values.shape
+    first, second = np.triu_indices(n_dates, k=1)
+    intervals = (days[second] - days[first]).astype(np.float64)
+    s = np.zeros(n_parcels)
+    sen = np.full(n_parcels, np.nan)
+    if len(first) == 0:
+        return s, sen
+
+    block = max(1, block_pairs // len(first))
+    for start in range(0, n_parcels, block):
+        rows = values[start:start + block]
+        differences = rows[:, second] - rows[:, first]
+        # Porovnání s NaN je nepravdivé, chybějící dvojice se tak do S nezapočítají
+        s[start:start + block] = np.count_nonzero(differences > 0, axis=1) - np.count_nonzero(differences < 0, axis=1)
+        differences /= intervals
+        sen[start:start + block] = _row_nanmedian(differences)
+    return s, sen
+
+
+def _row_nanmedian(values):
+    # Medián každého řádku bez NaN; np.nanmedian po řádcích volá pro velké matice Python smyčku.
+    # Seřazení řádků posune NaN na konec, medián je pak uprostřed platných hodnot.
+    values = np.sort(values, axis=1)
+    valid = (~np.isnan(values)).sum(axis=1)
+    lower = np.take_along_axis(values, np.maximum(valid - 1, 0)[:, None] // 2, axis=1)[:, 0]
+    upper = np.take_along_axis(values, (valid // 2)[:, None], axis=1)[:, 0]
+    return np.where(valid > 0, (lower + upper) / 2.0, np.nan)
+
+
+def _mann_kendall_z(s, n):
+    # Normální aproximace bez korekce na shody (hodnoty jsou spojité průměry)
+    variance = n * (n - 1) * (2 * n + 5) / 18.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(s > 0, s - 1, np.where(s < 0, s + 1, 0.0)) / np.sqrt(variance)
+    return np.where(n >= 3, z, np.nan)
+
+
+def _runs_above(values, critical):
+    # Nejdelší řada po sobě jdoucích dat nad kritickou úrovní a index prvního takového data (-1 = nikdy)
+    above = values > critical
+    positions = np.arange(values.shape[1])
+    last_below = np.maximum.accumulate(np.where(above, -1, positions), axis=1)
+    run_lengths = positions - last_below
+    longest = run_lengths.max(axis=1) if values.shape[1] else np.zeros(values.shape[0], dtype=np.int64)
+    onset = np.where(above.any(axis=1), above.argmax(axis=1), -1)
+    return longest, onset
+
+
+def parcel_trends(values, days, critical=CRITICAL_LEVEL, block_pairs=TREND_BLOCK_PAIRS):
+    # Trendové ukazatele pro všechny pozemky najednou (values: pozemky x data, days: pořadové dny dat).
+    # Sklony jsou v jednotkách úrovně sucha za den.
+    values = np.asarray(values, dtype=np.float64)
+    days = np.asarray(days, dtype=np.float64)
+    s, sen = _mann_kendall_sen(values, days, block_pairs)
+    longest, onset = _runs_above(values, critical)
+    return {
+        'slope': _ols_slope(values, days),
+        'sen_slope': sen,
+        'mk_z': _mann_kendall_z(s, (~np.isnan(values)).sum(axis=1).astype(np.float64)),
+        'longest_run': longest,
+        'onset': onset,
+    }
+
+
+# Počet pozemků v jednom bloku maticového součinu při hledání podobných pozemků
+SIMILARITY_BLOCK_ROWS = 8192
+
+
+def normalize_series(values):
+    # Řady pozemků vycentrované a škálované na jednotkovou normu (float32), skalární součin dvou řad
+    # je pak jejich korelace; chybějící hodnoty po vycentrování přispívají nulou
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(valid, values, 0.0).sum(axis=1, keepdims=True) / counts
+    centered = np.where(valid, values - means, 0.0)
+    norms = np.sqrt((centered * centered).sum(axis=1, keepdims=True))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normalized = np.where(norms > 0, centered / norms, 0.0)
+    return normalized.astype(np.float32)
+
+
+def top_k_similar(normalized, rows, k, block_rows=SIMILARITY_BLOCK_ROWS):
+    # k nejpodobnějších pozemků ke každému z řádků rows (bez něj samotného).
+    # Matice se prochází po blocích, v paměti je jen len(rows) x block_rows skóre a průběžné top-k.
+    rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+    queries = normalized[rows]
+    n = normalized.shape[0]
+    k = min(k, max(n - 1, 0))
+    best_scores = np.empty((len(rows), 0), dtype=np.float32)
+    best_indices = np.empty((len(rows), 0), dtype=np.int64)
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        scores = queries @ normalized[start:stop].T
+        own = (rows >= start) & (rows < stop)
+        scores[own, rows[own] - start] = -np.inf
+        scores = np.concatenate([best_scores, scores], axis=1)
+        indices = np.concatenate([best_indices, np.broadcast_to(np.arange(start, stop), (len(rows), stop - start))], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k else np.empty((len(rows), 0), dtype=np.int64)
+            scores = np.take_along_axis(scores, keep, axis=1)
+            indices = np.take_along_axis(indices, keep, axis=1)
+        best_scores, best_indices = scores, indices
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_indices, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def sample_rows(n, max_rows, seed=0):
+    # Deterministický vzorek řádků, aby se korelační pohled mezi běhy neměnil
+    if n <= max_rows:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, size=max_rows, replace=False))
+
+
+def cluster_order(correlation):
+    # Spektrální uspořádání: řazení podle Fiedlerova vektoru laplaciánu afinity (1 + r) / 2,
+    # podobné pozemky tak v heatmapě leží vedle sebe
+    correlation = np.nan_to_num(np.asarray(correlation, dtype=np.float64))
+    if len(correlation) < 3:
+        return np.arange(len(correlation))
+    affinity = (1.0 + correlation) / 2.0
+    np.fill_diagonal(affinity, 0.0)
+    laplacian = np.diag(affinity.sum(axis=1)) - affinity
+    _, vectors = np.linalg.eigh(laplacian)
+    return np.argsort(vectors[:, 1], kind='stable')
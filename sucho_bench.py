@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import sucho_db
+import sucho_export
+import sucho_pool
+
+logger = logging.getLogger(__name__)
+
+# Měření výkonu nad syntetickými daty: deterministický generátor tabulky pozemků (pozemky x data),
+# odpovídajících GeoTIFF rastrů a vrstvy pozemků. Časy jednotlivých kroků se ukládají do JSON,
+# aby šly porovnat mezi verzemi. Kroky s rastry se bez GDAL přeskočí.
+#
+#   python sucho_bench.py --scales 1000x30,10000x90 --output bench.json
+
+DEFAULT_SCALES = "1000x30,10000x90,50000x180"
+REPEAT = 3
+SEED = 42
+START_DATE = date(2024, 3, 1)
+DISTRICTS = 14
+MISSING_SHARE = 0.03
+# Počet rastrů (dat) pro měření zonální statistiky; čas jednoho rastru nezávisí na počtu dat
+RASTER_DATES = 10
+# Velikost pozemku v pixelech (čtverec) a pixelu v metrech v syntetické vrstvě
+PARCEL_PIXELS = 4
+PIXEL_SIZE = 10.0
+NODATA = -9999.0
+
+
+def synthetic_dates(n_dates, start=START_DATE):
+    return [(start + timedelta(days=i)).strftime('%Y%m%d') for i in range(n_dates)]
+
+
+def synthetic_attributes(n_parcels):
+    # ZKOD_DPB, ID_UZ, KU_KOD, OKRES_KOD; uživatelé a katastry se opakují jako ve skutečných datech
+    return [
+        (f"{1000 + i // 100:04d}/{i % 100 + 1}", str(10000 + i // 25), str(600000 + i // 400), f"CZ0{DISTRICTS + i % DISTRICTS:03d}")
+        for i in range(n_parcels)
+    ]
+
+
+def synthetic_values(n_parcels, n_dates, seed=SEED):
+    # Úroveň sucha 0-5: úroveň okresu, trend pozemku, sezónní vlna a šum; část hodnot chybí
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0.0, 1.0, n_dates)
+    district = (np.arange(n_parcels) % DISTRICTS) / DISTRICTS * 2.0 + 1.0
+    level = district[:, None] + rng.normal(0.0, 0.4, (n_parcels, 1))
+    trend = rng.normal(0.0, 1.0, (n_parcels, 1)) * t[None, :]
+    season = 0.8 * np.sin(2 * np.pi * (t[None, :] + rng.uniform(0.0, 0.2, (n_parcels, 1))))
+    values = np.clip(level + trend + season + rng.normal(0.0, 0.3, (n_parcels, n_dates)), 0.0, 5.0)
+    values[rng.random((n_parcels, n_dates)) < MISSING_SHARE] = np.nan
+    return values
+
+
+def write_sql_dump(path, n_parcels, n_dates, seed=SEED):
+    # Dump ve stejném tvaru jako export z sucho_mimo_QGIS.py (atributy + M_/N_ pro každé datum)
+    dates = synthetic_dates(n_dates)
+    values = synthetic_values(n_parcels, n_dates, seed)
+    fields = [(column, 'text') for column in sucho_db.KEY_COLUMNS]
+    for d in dates:
+        fields += [(f"M_{d}", 'real'), (f"N_{d}", 'int')]
+
+    def rows():
+        for attributes, series in zip(synthetic_attributes(n_parcels), values):
+            row = list(attributes)
+            for value in series:
+                missing = math.isnan(value)
+                row += [None if missing else float(value), None if missing else int(round(value))]
+            yield tuple(row)
+
+    sucho_export.export_table(fields, rows(), path, fmt='sql')
+    return path
+
+
+def write_rasters(folder, n_parcels, n_dates, seed=SEED):
+    # Vrstva čtvercových pozemků v mřížce a rastry SUCHO_<datum>.tif, kde každý pixel pozemku má hodnotu
+    # ze synthetic_values; průměr zonální statistiky tak musí hodnotu přesně vrátit
+    from osgeo import gdal, ogr, osr
+
+    os.makedirs(folder, exist_ok=True)
+    values = synthetic_values(n_parcels, n_dates, seed)
+    columns = int(math.ceil(math.sqrt(n_parcels)))
+    rows = int(math.ceil(n_parcels / columns))
+    xsize, ysize = columns * PARCEL_PIXELS, rows * PARCEL_PIXELS
+    top = ysize * PIXEL_SIZE
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32633)
+
+    shapefile_path = os.path.join(folder, "pozemky.shp")
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(shapefile_path):
+        driver.DeleteDataSource(shapefile_path)
+    ds = driver.CreateDataSource(shapefile_path)
+    layer = ds.CreateLayer("pozemky", srs, ogr.wkbPolygon)
+    for column in sucho_db.KEY_COLUMNS:
+        layer.CreateField(ogr.FieldDefn(column, ogr.OFTString))
+    size = PARCEL_PIXELS * PIXEL_SIZE
+    for i, attributes in enumerate(synthetic_attributes(n_parcels)):
+        x0 = (i % columns) * size
+        y0 = top - (i // columns) * size
+        feature = ogr.Feature(layer.GetLayerDefn())
+        for column, value in zip(sucho_db.KEY_COLUMNS, attributes):
+            feature.SetField(column, value)
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(
+            f"POLYGON(({x0} {y0},{x0 + size} {y0},{x0 + size} {y0 - size},{x0} {y0 - size},{x0} {y0}))"))
+        layer.CreateFeature(feature)
+    ds = None
+
+    grid = np.full(rows * columns, np.nan)
+    raster_paths = []
+    gtiff = gdal.GetDriverByName("GTiff")
+    for j, d in enumerate(synthetic_dates(n_dates)):
+        grid[:n_parcels] = values[:, j]
+        pixels = np.kron(grid.reshape(rows, columns), np.ones((PARCEL_PIXELS, PARCEL_PIXELS)))
+        raster_path = os.path.join(folder, f"SUCHO_{d}.tif")
+        raster = gtiff.Create(raster_path, xsize, ysize, 1, gdal.GDT_Float32, options=['COMPRESS=DEFLATE'])
+        raster.SetGeoTransform((0.0, PIXEL_SIZE, 0.0, top, 0.0, -PIXEL_SIZE))
+        raster.SetProjection(srs.ExportToWkt())
+        band = raster.GetRasterBand(1)
+        band.SetNoDataValue(NODATA)
+        band.WriteArray(np.where(np.isnan(pixels), NODATA, pixels).astype(np.float32))
+        raster = None
+        raster_paths.append(raster_path)
+    return shapefile_path, raster_paths, values
+
+
+def timed(func, repeat=REPEAT, setup=None):
+    # Opakované měření; setup běží před každým opakováním mimo měřený čas. Vrací (časy, poslední výsledek).
+    runs = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return runs, result
+
+
+def _record(results, scale, stage, runs, **extra):
+    entry = {
+        'parcels': scale[0],
+        'dates': scale[1],
+        'stage': stage,
+        'min_s': round(min(runs), 6),
+        'median_s': round(float(np.median(runs)), 6),
+        'runs_s': [round(r, 6) for r in runs],
+    }
+    entry.update(extra)
+    results.append(entry)
+    logger.info(f"{scale[0]:>7} x {scale[1]:<4} {stage:<24} {entry['median_s']:.4f} s")
+
+
+def bench_dashboard(viewer, workdir, scale, repeat, seed, results):
+    n_parcels, n_dates = scale
+    sql_path = write_sql_dump(os.path.join(workdir, "pozemky_data.sql"), n_parcels, n_dates, seed)
+    db_path = os.path.join(workdir, "sucho_database.db")
+    viewer.SQL_FILE_PATH = sql_path
+    viewer.DATABASE_NAME = db_path
+
+    def remove_database():
+        for path in (db_path, db_path + "-wal", db_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(db_path + ".matrix", ignore_errors=True)
+        viewer.get_dump_state.clear()
+
+    runs, _ = timed(viewer.create_db_from_sql, repeat, setup=remove_database)
+    _record(results, scale, 'create_db_from_sql', runs, dump_bytes=os.path.getsize(sql_path))
+
+    pool = sucho_pool.ConnectionPool(db_path, 2)
+    try:
+        viewer.get_result_cache.clear()
+        viewer.load_matrix.clear()
+        version = viewer.refresh_data_version(pool)
+
+        def unique_values():
+            return [viewer.get_unique_values(pool, column, None, '', version=version) for column in sucho_db.KEY_COLUMNS]
+
+        runs, _ = timed(unique_values, repeat, setup=viewer.get_unique_values.clear)
+        _record(results, scale, 'get_unique_values', runs)
+
+        def reset_results():
+            viewer.get_result_cache().ensure_version(None)
+            viewer.get_result_cache().ensure_version(version)
+
+        runs, df = timed(lambda: viewer.load_data(pool), repeat, setup=reset_results)
+        _record(results, scale, 'load_data', runs, rows=len(df))
+
+        m_columns = [col for col in df.columns if col.startswith('M_')]
+        runs, trends_df = timed(lambda: viewer.parcel_trend_table(df), repeat)
+        _record(results, scale, 'parcel_trend_table', runs)
+        runs, _ = timed(lambda: viewer.calculate_statistics(df, trends_df), repeat)
+        _record(results, scale, 'calculate_statistics', runs)
+        runs, _ = timed(lambda: viewer.drought_day_counts(df), repeat)
+        _record(results, scale, 'drought_day_counts', runs)
+        runs, _ = timed(lambda: viewer.time_series_figure(df, m_columns, 10), repeat)
+        _record(results, scale, 'time_series_figure', runs)
+    finally:
+        pool.close()
+
+
+def bench_zonal(workdir, scale, repeat, seed, results):
+    import sucho_zonal
+
+    n_parcels = scale[0]
+    n_dates = min(scale[1], RASTER_DATES)
+    shapefile_path, raster_paths, values = write_rasters(os.path.join(workdir, "rastry"), n_parcels, n_dates, seed)
+    grid = sucho_zonal.raster_grid(raster_paths[0])
+
+    runs, label_grid = timed(lambda: sucho_zonal.build_label_grid(shapefile_path, grid), repeat)
+    _record(results, scale, 'build_label_grid', runs)
+
+    def all_rasters():
+        return [sucho_zonal.raster_statistics(label_grid, path)['mean'] for path in raster_paths]
+
+    runs, means = timed(all_rasters, repeat)
+    # Kontrola správnosti: pozemek pokrývá celé pixely, průměr se musí shodovat se zdrojovou hodnotou
+    error = float(np.nanmax(np.abs(np.column_stack(means) - values))) if n_parcels else 0.0
+    _record(results, scale, 'zonal_statistics', runs, rasters=len(raster_paths), max_abs_error=error)
+
+
+def parse_scales(text):
+    scales = []
+    for item in text.split(','):
+        parcels, dates = item.lower().split('x')
+        scales.append((int(parcels), int(dates)))
+    return scales
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def gdal_available():
+    try:
+        from osgeo import gdal  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run(scales, output_path, repeat=REPEAT, seed=SEED, workdir=None, keep=False):
+    # Prohlížeč se importuje až zde: při importu nastavuje stránku Streamlit a logování
+    import SUCHO_ver_1 as viewer
+    # Ostatní moduly (úseky sucho_timing, prohlížeč) jen od WARNING, průběh měření na INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    # Streamlit nastavuje úroveň svým loggerům sám; mimo běh aplikace by hlásil chybějící kontext u každého volání
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('streamlit'):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    workdir = workdir or tempfile.mkdtemp(prefix="sucho_bench_")
+    has_gdal = gdal_available()
+    results = []
+    skipped = []
+    try:
+        for scale in scales:
+            scale_dir = os.path.join(workdir, f"{scale[0]}x{scale[1]}")
+            os.makedirs(scale_dir, exist_ok=True)
+            bench_dashboard(viewer, scale_dir, scale, repeat, seed, results)
+            if has_gdal:
+                bench_zonal(scale_dir, scale, repeat, seed, results)
+            else:
+                skipped.append({'parcels': scale[0], 'dates': scale[1],
+                                'stages': ['build_label_grid', 'zonal_statistics'], 'reason': 'GDAL není k dispozici'})
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+        'repeat': repeat,
+        'seed': seed,
+        'results': results,
+        'skipped': skipped,
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Výsledky uloženy do {output_path}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Měření výkonu importu, dotazů a analýz nad syntetickými daty")
+    parser.add_argument('--scales', default=DEFAULT_SCALES, help="velikosti pozemky x data, např. 1000x30,10000x90")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output', default=f"sucho_bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--workdir', help="adresář pro syntetická data (výchozí dočasný)")
+    parser.add_argument('--keep', action='store_true', help="ponechat vygenerovaná data")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    run(parse_scales(args.scales), args.output, args.repeat, args.seed, args.workdir, args.keep)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import sys
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_filters(filters):
+    # Stejný výběr v jiném pořadí dá stejný klíč
+    return tuple((key, tuple(sorted(map(str, values)))) for key, values in sorted((filters or {}).items()) if values)
+
+
+def make_key(kind, version, filters=None, date_from=None, date_to=None, *extra):
+    window = tuple(d.strftime('%Y%m%d') if d else None for d in (date_from, date_to))
+    return (kind, version, normalize_filters(filters), window) + extra
+
+
+def estimate_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    nbytes = getattr(value, 'nbytes', None)
+    return int(nbytes) if nbytes is not None else sys.getsizeof(value)
+
+
+class ResultCache:
+    # LRU cache výsledků sdílená všemi relacemi procesu, omezená celkovou velikostí v bajtech.
+    # Při změně verze dat se celý obsah zahodí.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.version = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    def ensure_version(self, version):
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    logger.info(f"Nová verze dat {version}, cache vyprázdněna")
+                self._entries.clear()
+                self._bytes = 0
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def get_or_compute(self, key, compute):
+        # Výpočet běží mimo zámek; při souběhu dvou relací se výsledek jen uloží dvakrát
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
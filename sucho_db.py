@@ -0,0 +1,597 @@
+import sqlite3
+import logging
+import math
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import sucho_analytics
+import sucho_manifest
+import sucho_timing
+
+logger = logging.getLogger(__name__)
+
+# Názvy tabulek
+WIDE_TABLE = "pozemky_data"
+PARCEL_TABLE = "pozemky"
+VALUES_TABLE = "pozemky_hodnoty"
+META_TABLE = "sucho_meta"
+DISTRICT_DATE_TABLE = "agg_okres_datum"
+DATE_TABLE = "agg_datum"
+PARCEL_SUMMARY_TABLE = "agg_pozemek"
+FILTER_TABLE = "pozemky_filtry"
+
+# Zvýšit při každé změně schématu, aby se existující databáze přestavěla
+SCHEMA_VERSION = 4
+IMPORT_BATCH_SIZE = 5000
+# Jak dlouho (s) čeká zápis na zámek databáze drženým jiným procesem
+BUSY_TIMEOUT = 60
+
+KEY_COLUMNS = ['ZKOD_DPB', 'ID_UZ', 'KU_KOD', 'OKRES_KOD']
+
+# Hodnoty, které export z QGIS zapisuje místo chybějících dat
+NULL_TOKENS = ('', 'NULL', 'None')
+
+
+LONG_SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS {PARCEL_TABLE} (
+        pozemek_id INTEGER PRIMARY KEY,
+        ZKOD_DPB TEXT,
+        ID_UZ TEXT,
+        KU_KOD TEXT,
+        OKRES_KOD TEXT
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_pozemky_zkod ON {PARCEL_TABLE} (ZKOD_DPB)",
+    f"CREATE INDEX IF NOT EXISTS idx_pozemky_uz ON {PARCEL_TABLE} (ID_UZ)",
+    f"CREATE INDEX IF NOT EXISTS idx_pozemky_ku ON {PARCEL_TABLE} (KU_KOD)",
+    f"CREATE INDEX IF NOT EXISTS idx_pozemky_okres ON {PARCEL_TABLE} (OKRES_KOD)",
+    # Dlouhý formát: jeden řádek na (pozemek, datum) místo jednoho sloupce na datum
+    f"""CREATE TABLE IF NOT EXISTS {VALUES_TABLE} (
+        pozemek_id INTEGER NOT NULL,
+        datum TEXT NOT NULL,
+        mean REAL,
+        majority INTEGER,
+        PRIMARY KEY (pozemek_id, datum)
+    ) WITHOUT ROWID""",
+    f"CREATE INDEX IF NOT EXISTS idx_hodnoty_datum ON {VALUES_TABLE} (datum, pozemek_id)",
+    f"CREATE TABLE IF NOT EXISTS {META_TABLE} (klic TEXT PRIMARY KEY, hodnota TEXT)",
+    # Úzká tabulka kombinací filtrů pro nabídky v postranním panelu; NOCASE umožní LIKE 'abc%' přes index
+    f"""CREATE TABLE IF NOT EXISTS {FILTER_TABLE} (
+        ZKOD_DPB TEXT COLLATE NOCASE,
+        ID_UZ TEXT COLLATE NOCASE,
+        KU_KOD TEXT COLLATE NOCASE,
+        OKRES_KOD TEXT COLLATE NOCASE
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_filtry_zkod ON {FILTER_TABLE} (ZKOD_DPB)",
+    f"CREATE INDEX IF NOT EXISTS idx_filtry_uz ON {FILTER_TABLE} (ID_UZ, ZKOD_DPB)",
+    f"CREATE INDEX IF NOT EXISTS idx_filtry_ku ON {FILTER_TABLE} (KU_KOD, ZKOD_DPB, ID_UZ)",
+    f"CREATE INDEX IF NOT EXISTS idx_filtry_okres ON {FILTER_TABLE} (OKRES_KOD, ZKOD_DPB, ID_UZ, KU_KOD)",
+    # Souhrnné tabulky počítané při importu, aby přehledy nemusely číst celou matici
+    f"""CREATE TABLE IF NOT EXISTS {DISTRICT_DATE_TABLE} (
+        OKRES_KOD TEXT,
+        datum TEXT NOT NULL,
+        mean REAL,
+        min REAL,
+        max REAL,
+        count INTEGER
+    )""",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS idx_agg_okres_datum ON {DISTRICT_DATE_TABLE} (OKRES_KOD, datum)",
+    f"CREATE INDEX IF NOT EXISTS idx_agg_okres_datum_datum ON {DISTRICT_DATE_TABLE} (datum)",
+    f"""CREATE TABLE IF NOT EXISTS {DATE_TABLE} (
+        datum TEXT PRIMARY KEY,
+        mean REAL,
+        min REAL,
+        max REAL,
+        count INTEGER
+    )""",
+    # Souhrn za celou sezónu pro každý pozemek včetně trendových ukazatelů (sucho_analytics.parcel_trends);
+    # trendy doplňuje až ensure_parcel_trends po importu
+    f"""CREATE TABLE IF NOT EXISTS {PARCEL_SUMMARY_TABLE} (
+        pozemek_id INTEGER PRIMARY KEY,
+        mean REAL,
+        count INTEGER,
+        slope REAL,
+        sen_slope REAL,
+        mk_z REAL,
+        longest_run INTEGER,
+        onset TEXT
+    )""",
+    f"CREATE INDEX IF NOT EXISTS idx_agg_pozemek_sen ON {PARCEL_SUMMARY_TABLE} (sen_slope)",
+]
+
+# Odvozené tabulky se při přestavbě zahazují celé, aby převzaly případné nové sloupce
+AGGREGATE_TABLES = (DISTRICT_DATE_TABLE, DATE_TABLE, PARCEL_SUMMARY_TABLE)
+
+
+def create_long_schema(conn):
+    # Jednotlivé příkazy místo executescript, který by potvrdil rozpracovanou transakci
+    for statement in LONG_SCHEMA:
+        conn.execute(statement)
+
+
+def wide_date_columns(conn):
+    # Seznam dat (YYYYMMDD), pro která má široká tabulka sloupec M_
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({WIDE_TABLE})")]
+    dates = sorted(col[2:] for col in columns if col.startswith('M_'))
+    return dates, set(columns)
+
+
+def _numeric_sql(column, cast):
+    nulls = ', '.join(f"'{token}'" for token in NULL_TOKENS)
+    return f"CASE WHEN {column} IS NULL OR TRIM({column}) IN ({nulls}) THEN NULL ELSE CAST({column} AS {cast}) END"
+
+
+def _fill_long_tables(conn):
+    for table in AGGREGATE_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    create_long_schema(conn)
+    dates, columns = wide_date_columns(conn)
+
+    conn.execute(f"DELETE FROM {VALUES_TABLE}")
+    conn.execute(f"DELETE FROM {PARCEL_TABLE}")
+    conn.execute(
+        f"INSERT INTO {PARCEL_TABLE} (pozemek_id, {', '.join(KEY_COLUMNS)}) "
+        f"SELECT rowid, {', '.join(KEY_COLUMNS)} FROM {WIDE_TABLE}"
+    )
+    for date in dates:
+        majority_col = f"N_{date}"
+        majority_sql = _numeric_sql(majority_col, 'INTEGER') if majority_col in columns else "NULL"
+        conn.execute(
+            f"INSERT INTO {VALUES_TABLE} (pozemek_id, datum, mean, majority) "
+            f"SELECT rowid, ?, {_numeric_sql(f'M_{date}', 'REAL')}, {majority_sql} FROM {WIDE_TABLE}",
+            (date,)
+        )
+
+    conn.execute(f"DELETE FROM {FILTER_TABLE}")
+    conn.execute(
+        f"INSERT INTO {FILTER_TABLE} ({', '.join(KEY_COLUMNS)}) "
+        f"SELECT DISTINCT {', '.join(KEY_COLUMNS)} FROM {PARCEL_TABLE}"
+    )
+    refresh_aggregates(conn)
+    bump_data_version(conn)
+    logger.info(f"Dlouhý formát vytvořen: {len(dates)} dat")
+    return dates
+
+
+def refresh_aggregates(conn, dates=None):
+    # Přepočet souhrnů za okres a datum, za datum a za pozemek (celá sezóna).
+    # S dates se okresní a denní souhrny přepočítají jen pro tato data.
+    date_sql = ''
+    params = []
+    if dates is not None:
+        date_sql = f"WHERE datum IN ({','.join(['?'] * len(dates))})"
+        params = list(dates)
+
+    conn.execute(f"DELETE FROM {DISTRICT_DATE_TABLE} {date_sql}", params)
+    conn.execute(
+        f"INSERT INTO {DISTRICT_DATE_TABLE} (OKRES_KOD, datum, mean, min, max, count) "
+        f"SELECT p.OKRES_KOD, h.datum, AVG(h.mean), MIN(h.mean), MAX(h.mean), COUNT(h.mean) "
+        f"FROM {VALUES_TABLE} h JOIN {PARCEL_TABLE} p ON p.pozemek_id = h.pozemek_id "
+        f"{date_sql.replace('datum', 'h.datum')} GROUP BY p.OKRES_KOD, h.datum", params
+    )
+    conn.execute(f"DELETE FROM {DATE_TABLE} {date_sql}", params)
+    conn.execute(
+        f"INSERT INTO {DATE_TABLE} (datum, mean, min, max, count) "
+        f"SELECT datum, AVG(mean), MIN(mean), MAX(mean), COUNT(mean) FROM {VALUES_TABLE} {date_sql} GROUP BY datum", params
+    )
+    conn.execute(f"DELETE FROM {PARCEL_SUMMARY_TABLE}")
+    conn.execute(
+        f"INSERT INTO {PARCEL_SUMMARY_TABLE} (pozemek_id, mean, count) "
+        f"SELECT pozemek_id, AVG(mean), COUNT(mean) FROM {VALUES_TABLE} GROUP BY pozemek_id"
+    )
+    # Trendové sloupce zůstanou prázdné, dopočítá je ensure_parcel_trends po dokončení importu
+
+
+def _read_value_matrix(conn):
+    # Matice průměrů pozemky x data (float64, NaN = chybí), plněná po jednotlivých datech
+    parcels = np.array([row[0] for row in conn.execute(
+        f"SELECT pozemek_id FROM {PARCEL_TABLE} ORDER BY pozemek_id")], dtype=np.int64)
+    dates = [row[0] for row in conn.execute(f"SELECT datum FROM {DATE_TABLE} ORDER BY datum")]
+    values = np.full((len(parcels), len(dates)), np.nan)
+    for j, date in enumerate(dates):
+        rows = conn.execute(f"SELECT pozemek_id, mean FROM {VALUES_TABLE} WHERE datum = ?", (date,)).fetchall()
+        if rows:
+            column = np.array(rows, dtype=np.float64)
+            values[np.searchsorted(parcels, column[:, 0].astype(np.int64)), j] = column[:, 1]
+    return parcels, dates, values
+
+
+def _refresh_parcel_trends(conn):
+    parcels, dates, values = _read_value_matrix(conn)
+    if not len(parcels) or not dates:
+        return
+    days = pd.to_datetime(dates, format='%Y%m%d').to_numpy().astype('datetime64[D]').astype(np.int64)
+    trends = sucho_analytics.parcel_trends(values, days)
+
+    def value(x):
+        return None if np.isnan(x) else float(x)
+
+    conn.executemany(
+        f"UPDATE {PARCEL_SUMMARY_TABLE} SET slope = ?, sen_slope = ?, mk_z = ?, longest_run = ?, onset = ? "
+        f"WHERE pozemek_id = ?",
+        (
+            (value(slope), value(sen), value(z), int(run), dates[onset] if onset >= 0 else None, int(pozemek_id))
+            for pozemek_id, slope, sen, z, run, onset in zip(
+                parcels, trends['slope'], trends['sen_slope'], trends['mk_z'], trends['longest_run'], trends['onset'])
+        )
+    )
+
+
+def ensure_parcel_trends(conn):
+    # Trendy pozemků stojí O(pozemky x data²), proto se nepočítají v transakci doplnění dat,
+    # ale jednou pro každou verzi dat jako samostatný krok importu; prohlížeč je jen čte.
+    # Vrací True, pokud se přepočítávaly.
+    version = data_version(conn)
+    if version is None or get_meta(conn, 'trends_version') == version:
+        return False
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Verze se ověří znovu pod zámkem zápisu, mezitím mohl trendy spočítat jiný proces
+        version = data_version(conn)
+        if get_meta(conn, 'trends_version') == version:
+            conn.execute("COMMIT")
+            return False
+        with sucho_timing.span('db_parcel_trends'):
+            _refresh_parcel_trends(conn)
+        set_meta(conn, 'trends_version', version)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info(f"Trendy pozemků přepočítány pro verzi dat {version}")
+    return True
+
+
+def ensure_trends(db_path):
+    conn = connect(db_path)
+    try:
+        return ensure_parcel_trends(conn)
+    finally:
+        conn.close()
+
+
+def file_fingerprint(path):
+    return f"{sucho_manifest.file_sha256(path)}:v{SCHEMA_VERSION}"
+
+
+def get_meta(conn, key):
+    try:
+        row = conn.execute(f"SELECT hodnota FROM {META_TABLE} WHERE klic = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def set_meta(conn, key, value):
+    conn.execute(f"INSERT OR REPLACE INTO {META_TABLE} (klic, hodnota) VALUES (?, ?)", (key, str(value)))
+
+
+def data_version(conn):
+    # Mění se s každým importem nebo doplněním dat; slouží k invalidaci cache
+    return get_meta(conn, 'data_version')
+
+
+def bump_data_version(conn):
+    set_meta(conn, 'data_version', uuid.uuid4().hex)
+
+
+_INSERT_RE = re.compile(r"INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES\s*(.*?);?\s*$", re.IGNORECASE | re.DOTALL)
+_VALUE_TOKEN_RE = re.compile(r"'((?:[^']|'')*)'|(\()|(\))|(,)|([^\s,()']+)")
+
+
+def _parse_literal(token):
+    if token.upper() == 'NULL':
+        return None
+    try:
+        return int(token)
+    except ValueError:
+        return float(token)
+
+
+def parse_insert(statement):
+    # Rozparsuje INSERT s jedním nebo více řádky hodnot na (tabulka, sloupce, řádky)
+    match = _INSERT_RE.match(statement.strip())
+    if match is None:
+        raise ValueError(f"Nepodporovaný příkaz INSERT: {statement[:80]}")
+    table, columns, values = match.groups()
+    columns = [col.strip() for col in columns.split(',')]
+
+    rows = []
+    row = None
+    for match in _VALUE_TOKEN_RE.finditer(values):
+        string, opening, closing, _, literal = match.groups()
+        if opening:
+            row = []
+        elif closing:
+            rows.append(tuple(row))
+            row = None
+        elif row is None or _:
+            continue
+        elif string is not None:
+            row.append(string.replace("''", "'"))
+        else:
+            row.append(_parse_literal(literal))
+    return table, columns, rows
+
+
+def _create_table_sql(statement):
+    # Převod MySQL definice tabulky z exportu na SQLite (bez AUTO_INCREMENT id a koncové čárky)
+    body = statement[statement.index('(') + 1:statement.rindex(')')]
+    definitions = [line.strip().rstrip(',') for line in body.splitlines()]
+    definitions = [d for d in definitions if d and 'AUTO_INCREMENT' not in d.upper()]
+    return f"CREATE TABLE {WIDE_TABLE} (\n  " + ',\n  '.join(definitions) + "\n)"
+
+
+def iter_sql_statements(sql_path):
+    # Postupné čtení dumpu po příkazech, bez načtení celého souboru do paměti
+    buffer = []
+    with open(sql_path, 'r', encoding='utf-8') as sql_file:
+        for line in sql_file:
+            if not line.strip() and not buffer:
+                continue
+            buffer.append(line)
+            if line.rstrip().endswith(';'):
+                yield ''.join(buffer)
+                buffer = []
+    if buffer and ''.join(buffer).strip():
+        yield ''.join(buffer)
+
+
+def import_sql_dump(conn, sql_path, batch_size=IMPORT_BATCH_SIZE):
+    # Import dumpu v dávkách přes připravené příkazy; volá se uvnitř otevřené transakce
+    conn.execute(f"DROP TABLE IF EXISTS {WIDE_TABLE}")
+    created = False
+    batch = []
+    insert_sql = None
+    row_count = 0
+
+    def flush():
+        nonlocal batch
+        if batch:
+            conn.executemany(insert_sql, batch)
+            batch = []
+
+    for statement in iter_sql_statements(sql_path):
+        head = statement.lstrip()[:12].upper()
+        if head.startswith('CREATE TABLE'):
+            conn.execute(_create_table_sql(statement))
+            created = True
+        elif head.startswith('INSERT'):
+            if not created:
+                raise ValueError("Dump neobsahuje CREATE TABLE před příkazy INSERT")
+            _, columns, rows = parse_insert(statement)
+            statement_sql = f"INSERT INTO {WIDE_TABLE} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+            if statement_sql != insert_sql:
+                flush()
+                insert_sql = statement_sql
+            batch.extend(rows)
+            row_count += len(rows)
+            if len(batch) >= batch_size:
+                flush()
+    flush()
+
+    if not created:
+        raise ValueError(f"Dump {sql_path} neobsahuje definici tabulky {WIDE_TABLE}")
+    return row_count
+
+
+def connect(db_path):
+    # isolation_level=None: transakce řídíme explicitně (BEGIN IMMEDIATE / COMMIT).
+    # WAL: čtenáři (sucho_pool) neblokují zápis a zápis neblokuje čtenáře; režim se uloží do souboru databáze.
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def build_database(sql_path, db_path):
+    # Import dumpu proběhne jen tehdy, když se změnil jeho otisk (nebo verze schématu)
+    conn = connect(db_path)
+    fingerprint = file_fingerprint(sql_path)
+    if get_meta(conn, 'dump_fingerprint') == fingerprint:
+        logger.info("Databáze je aktuální, import SQL dumpu přeskočen")
+        return conn
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Jiný proces mohl mezitím import dokončit
+        if get_meta(conn, 'dump_fingerprint') == fingerprint:
+            conn.execute("COMMIT")
+            return conn
+        with sucho_timing.span('db_import', nbytes=os.path.getsize(sql_path)) as current:
+            row_count = import_sql_dump(conn, sql_path)
+            current.record(rows=row_count)
+        with sucho_timing.span('db_long_tables', rows=row_count):
+            dates = _fill_long_tables(conn)
+        set_meta(conn, 'dump_fingerprint', fingerprint)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        conn.close()
+        raise
+
+    logger.info(f"Databáze vytvořena z SQL dumpu: {row_count} pozemků, {len(dates)} dat")
+    return conn
+
+
+def _sql_value(value, cast):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return cast(value)
+
+
+def ingest_dates(conn, columns, dump_fingerprint=None):
+    # Doplnění nebo přepsání jednotlivých dat bez nového importu celého dumpu.
+    # columns: {datum: (mean, majority)}, hodnoty v pořadí pozemků jako v exportu (pozemek_id 1..n).
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ids = [row[0] for row in conn.execute(f"SELECT pozemek_id FROM {PARCEL_TABLE} ORDER BY pozemek_id")]
+        _, wide_columns = wide_date_columns(conn)
+        for date in sorted(columns):
+            mean, majority = columns[date]
+            if len(mean) != len(ids):
+                raise ValueError(f"Datum {date}: {len(mean)} hodnot, databáze má {len(ids)} pozemků")
+            rows = [(pozemek_id, _sql_value(m, float), _sql_value(n, int)) for pozemek_id, m, n in zip(ids, mean, majority)]
+
+            if f"M_{date}" not in wide_columns:
+                conn.execute(f"ALTER TABLE {WIDE_TABLE} ADD COLUMN M_{date} DOUBLE")
+                conn.execute(f"ALTER TABLE {WIDE_TABLE} ADD COLUMN N_{date} INT")
+            conn.executemany(f"UPDATE {WIDE_TABLE} SET M_{date} = ?, N_{date} = ? WHERE rowid = ?",
+                             [(m, n, pozemek_id) for pozemek_id, m, n in rows])
+            conn.executemany(f"INSERT OR REPLACE INTO {VALUES_TABLE} (pozemek_id, datum, mean, majority) VALUES (?, ?, ?, ?)",
+                             [(pozemek_id, date, m, n) for pozemek_id, m, n in rows])
+        refresh_aggregates(conn, sorted(columns))
+        bump_data_version(conn)
+        if dump_fingerprint:
+            set_meta(conn, 'dump_fingerprint', dump_fingerprint)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info(f"Do databáze doplněno {len(columns)} dat")
+
+
+def sync_database(db_path, columns, previous_fingerprint, dump_path):
+    # Databáze se doplní jen o nová data, pokud odpovídala předchozímu dumpu;
+    # jinak ji prohlížeč při dalším startu sestaví z nového dumpu celou.
+    if not columns or not os.path.exists(db_path):
+        return False
+    conn = connect(db_path)
+    try:
+        if previous_fingerprint is None or get_meta(conn, 'dump_fingerprint') != previous_fingerprint:
+            logger.warning(f"Databáze {db_path} neodpovídá předchozímu dumpu, doplnění dat přeskočeno")
+            return False
+        with sucho_timing.span('db_ingest', dates=len(columns)):
+            ingest_dates(conn, columns, file_fingerprint(dump_path))
+        return True
+    finally:
+        conn.close()
+
+
+def _parcel_filter_sql(filters, alias=''):
+    prefix = f"{alias}." if alias else ''
+    clauses = []
+    params = []
+    for column in KEY_COLUMNS:
+        values = (filters or {}).get(column)
+        if values:
+            clauses.append(f"{prefix}{column} IN ({','.join(['?'] * len(values))})")
+            params.extend(values)
+    return clauses, params
+
+
+def _date_filter_sql(date_from, date_to, alias=''):
+    prefix = f"{alias}." if alias else ''
+    clauses = []
+    params = []
+    if date_from:
+        clauses.append(f"{prefix}datum >= ?")
+        params.append(date_from.strftime('%Y%m%d'))
+    if date_to:
+        clauses.append(f"{prefix}datum <= ?")
+        params.append(date_to.strftime('%Y%m%d'))
+    return clauses, params
+
+
+def unique_values(conn, column, filters=None, prefix='', limit=None):
+    # Hodnoty pro kaskádové filtry z tabulky pozemky_filtry, s hledáním podle začátku hodnoty
+    if column not in KEY_COLUMNS:
+        raise ValueError(f"Neznámý sloupec filtru: {column}")
+    clauses, params = _parcel_filter_sql({key: values for key, values in (filters or {}).items() if key != column})
+    clauses = [f"{column} IS NOT NULL", f"{column} != ''"] + clauses
+    if prefix:
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+        params.append(escaped + '%')
+    query = f"SELECT DISTINCT {column} FROM {FILTER_TABLE} WHERE {' AND '.join(clauses)} ORDER BY {column}"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return [row[0] for row in conn.execute(query, params)]
+
+
+def query_parcels(conn, filters=None):
+    clauses, params = _parcel_filter_sql(filters)
+    where = ' AND '.join(['1=1'] + clauses)
+    return pd.read_sql(
+        f"SELECT pozemek_id, {', '.join(KEY_COLUMNS)} FROM {PARCEL_TABLE} WHERE {where} ORDER BY pozemek_id",
+        conn, params=params
+    )
+
+
+def query_wide(conn, filters=None, date_from=None, date_to=None, parcels=None):
+    # Filtry pozemků i rozsah dat se vyhodnotí v SQL, do širokého tvaru se převedou jen vybraná data.
+    # parcels: souvislý úsek výsledku query_parcels (čtení po blocích), jinak se načtou všechny vybrané pozemky
+    parcel_clauses, parcel_params = _parcel_filter_sql(filters, 'p')
+    if parcels is None:
+        parcels = query_parcels(conn, filters)
+    elif len(parcels):
+        parcel_clauses.append("h.pozemek_id BETWEEN ? AND ?")
+        parcel_params = parcel_params + [int(parcels['pozemek_id'].iloc[0]), int(parcels['pozemek_id'].iloc[-1])]
+    date_clauses, date_params = _date_filter_sql(date_from, date_to, 'h')
+    where = ' AND '.join(['1=1'] + parcel_clauses + date_clauses)
+    values = pd.read_sql(
+        f"SELECT h.pozemek_id, h.datum, h.mean FROM {VALUES_TABLE} h "
+        f"JOIN {PARCEL_TABLE} p ON p.pozemek_id = h.pozemek_id WHERE {where}",
+        conn, params=parcel_params + date_params
+    )
+
+    matrix = values.pivot(index='pozemek_id', columns='datum', values='mean')
+    matrix = matrix.reindex(index=parcels['pozemek_id'], columns=sorted(matrix.columns))
+    matrix.columns = [f"M_{date}" for date in matrix.columns]
+
+    df = pd.concat([parcels.set_index('pozemek_id'), matrix.astype('float64')], axis=1)
+    return df.reset_index(drop=True)
+
+
+def district_summary(conn, okres_kod=None, date_from=None, date_to=None):
+    # Okresní přehled ze souhrnné tabulky: průměr vážený počtem hodnot, rozsah denních hodnot pozemků
+    clauses, params = _date_filter_sql(date_from, date_to)
+    if okres_kod:
+        clauses.append(f"OKRES_KOD IN ({','.join(['?'] * len(okres_kod))})")
+        params.extend(okres_kod)
+    where = ' AND '.join(['count > 0'] + clauses)
+    return pd.read_sql(
+        f"SELECT OKRES_KOD, SUM(mean * count) / SUM(count) AS mean, MIN(min) AS min, MAX(max) AS max, "
+        f"SUM(count) AS count FROM {DISTRICT_DATE_TABLE} WHERE {where} GROUP BY OKRES_KOD",
+        conn, params=params
+    )
+
+
+def date_summary(conn, okres_kod=None, date_from=None, date_to=None):
+    # Průměrná úroveň sucha za datum: celostátní tabulka, nebo vážený průměr vybraných okresů
+    clauses, params = _date_filter_sql(date_from, date_to)
+    if okres_kod:
+        clauses.append(f"OKRES_KOD IN ({','.join(['?'] * len(okres_kod))})")
+        params.extend(okres_kod)
+        where = ' AND '.join(['count > 0'] + clauses)
+        query = (f"SELECT datum, SUM(mean * count) / SUM(count) AS mean, MIN(min) AS min, MAX(max) AS max, "
+                 f"SUM(count) AS count FROM {DISTRICT_DATE_TABLE} WHERE {where} GROUP BY datum ORDER BY datum")
+    else:
+        where = ' AND '.join(['1=1'] + clauses)
+        query = f"SELECT datum, mean, min, max, count FROM {DATE_TABLE} WHERE {where} ORDER BY datum"
+    df = pd.read_sql(query, conn, params=params)
+    df['date'] = pd.to_datetime(df['datum'], format='%Y%m%d')
+    return df
+
+
+def parcel_summary(conn, filters=None, order_by=None, limit=None):
+    # Průměr a trendové ukazatele za celou sezónu pro každý pozemek.
+    # order_by: sloupec souhrnu, podle kterého se sestupně řadí (např. 'sen_slope')
+    clauses, params = _parcel_filter_sql(filters, 'p')
+    where = ' AND '.join(['1=1'] + clauses)
+    columns = ['mean', 'count'] + list(sucho_analytics.TREND_COLUMNS)
+    sql = (
+        f"SELECT {', '.join('p.' + col for col in KEY_COLUMNS)}, {', '.join('a.' + col for col in columns)} "
+        f"FROM {PARCEL_SUMMARY_TABLE} a JOIN {PARCEL_TABLE} p ON p.pozemek_id = a.pozemek_id WHERE {where}"
+    )
+    if order_by is not None:
+        if order_by not in columns:
+            raise ValueError(f"Neznámý sloupec souhrnu pozemků: {order_by}")
+        sql += f" ORDER BY a.{order_by} IS NULL, a.{order_by} DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = params + [int(limit)]
+    return pd.read_sql(sql, conn, params=params)
@@ -0,0 +1,212 @@
+import io
+import os
+import csv
+import gzip
+import math
+import sqlite3
+import logging
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "pozemky_data"
+BATCH_SIZE = 1000
+
+# Typy sloupců: 'int', 'real', 'text'
+SQL_TYPES = {'int': 'INT', 'real': 'DOUBLE', 'text': 'VARCHAR(255)'}
+SQLITE_TYPES = {'int': 'INTEGER', 'real': 'REAL', 'text': 'TEXT'}
+CSV_NULL = r'\N'
+EXTENSIONS = {'sql': '.sql', 'sqlite': '.db', 'parquet': '.parquet', 'csv': '.csv'}
+
+# Formáty stahování z prohlížeče: (popisek, přípona, MIME typ)
+DOWNLOAD_FORMATS = {
+    'csv': ('CSV', '.csv', 'text/csv'),
+    'csv.gz': ('CSV (gzip)', '.csv.gz', 'application/gzip'),
+    'parquet': ('Parquet', '.parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def field_kind(type_name):
+    # Převod názvu typu pole z QGIS/OGR na typ exportu
+    if type_name in ('Integer', 'Integer64', 'int'):
+        return 'int'
+    if type_name in ('Real', 'Double', 'real'):
+        return 'real'
+    return 'text'
+
+
+def coerce_value(value, kind):
+    if value is None:
+        return None
+    if kind == 'text':
+        return str(value)
+    try:
+        value = int(value) if kind == 'int' else float(value)
+    except (TypeError, ValueError):
+        return None
+    if kind == 'real' and not math.isfinite(value):
+        return None
+    return value
+
+
+def iter_batches(fields, rows, batch_size=BATCH_SIZE):
+    # Postupně převádí řádky na typované dávky, celá vrstva se nikdy nedrží v paměti
+    kinds = [kind for _, kind in fields]
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            return
+        yield [tuple(coerce_value(v, k) for v, k in zip(row, kinds)) for row in chunk]
+
+
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + value.replace("'", "''") + "'"
+
+
+def create_table_sql(fields, types=SQL_TYPES, table=TABLE_NAME):
+    columns = ',\n'.join(f"  {name} {types[kind]}" for name, kind in fields)
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n{columns}\n);\n"
+
+
+def write_sql(output_path, fields, batches):
+    # Textový SQL dump s víceřádkovými INSERTy a typovanými hodnotami
+    columns = ', '.join(name for name, _ in fields)
+    rows_written = 0
+    with open(output_path, 'w', encoding='utf-8') as sql_file:
+        sql_file.write(create_table_sql(fields) + "\n")
+        for batch in batches:
+            values = ',\n'.join('(' + ', '.join(sql_literal(v) for v in row) + ')' for row in batch)
+            sql_file.write(f"INSERT INTO {TABLE_NAME} ({columns}) VALUES\n{values};\n")
+            rows_written += len(batch)
+    return rows_written
+
+
+def write_sqlite(output_path, fields, batches):
+    # Přímý zápis do SQLite databáze v jedné transakci
+    conn = sqlite3.connect(output_path)
+    rows_written = 0
+    try:
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+            conn.execute(create_table_sql(fields, SQLITE_TYPES).rstrip(';\n'))
+            insert_sql = (f"INSERT INTO {TABLE_NAME} ({', '.join(name for name, _ in fields)}) "
+                          f"VALUES ({', '.join(['?'] * len(fields))})")
+            for batch in batches:
+                conn.executemany(insert_sql, batch)
+                rows_written += len(batch)
+    finally:
+        conn.close()
+    return rows_written
+
+
+def write_parquet(output_path, fields, batches):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Export do Parquet vyžaduje balíček pyarrow") from e
+
+    arrow_types = {'int': pa.int64(), 'real': pa.float64(), 'text': pa.string()}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in fields])
+    rows_written = 0
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for batch in batches:
+            arrays = [pa.array(column, type=schema.field(i).type) for i, column in enumerate(zip(*batch))]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            rows_written += len(batch)
+    return rows_written
+
+
+def write_csv(output_path, fields, batches):
+    # CSV pro hromadné načtení (LOAD DATA / COPY); vedle se zapíše SQL s definicí tabulky a příkazem načtení
+    rows_written = 0
+    with open(output_path, 'w', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow([name for name, _ in fields])
+        for batch in batches:
+            writer.writerows([CSV_NULL if v is None else repr(v) if isinstance(v, float) else v for v in row]
+                             for row in batch)
+            rows_written += len(batch)
+
+    load_path = os.path.splitext(output_path)[0] + "_load.sql"
+    with open(load_path, 'w', encoding='utf-8') as sql_file:
+        sql_file.write(create_table_sql(fields) + "\n")
+        sql_file.write(f"LOAD DATA LOCAL INFILE '{os.path.basename(output_path)}' INTO TABLE {TABLE_NAME}\n"
+                       "  FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'\n"
+                       "  LINES TERMINATED BY '\\n'\n"
+                       f"  IGNORE 1 LINES ({', '.join(name for name, _ in fields)});\n")
+    return rows_written
+
+
+WRITERS = {
+    'sql': write_sql,
+    'sqlite': write_sqlite,
+    'parquet': write_parquet,
+    'csv': write_csv,
+}
+
+
+def export_table(fields, rows, output_path, fmt='sql', batch_size=BATCH_SIZE):
+    # fields: seznam (název, typ), rows: iterátor n-tic hodnot ve stejném pořadí
+    if fmt not in WRITERS:
+        raise ValueError(f"Neznámý formát exportu: {fmt}")
+    rows_written = WRITERS[fmt](output_path, fields, iter_batches(fields, rows, batch_size))
+    logger.info(f"Export ({fmt}) dokončen: {rows_written} řádků -> {output_path}")
+    return rows_written
+
+
+def _write_csv_frames(frames, binary_file):
+    text_file = io.TextIOWrapper(binary_file, encoding='utf-8', newline='')
+    rows_written = 0
+    for i, frame in enumerate(frames):
+        frame.to_csv(text_file, index=False, header=(i == 0))
+        rows_written += len(frame)
+    text_file.flush()
+    text_file.detach()
+    return rows_written
+
+
+def write_frames(frames, binary_file, fmt='csv'):
+    # Zápis iterátoru DataFrame bloků do otevřeného binárního souboru; v paměti je vždy jen jeden blok
+    if fmt == 'csv':
+        return _write_csv_frames(frames, binary_file)
+    if fmt == 'csv.gz':
+        with gzip.GzipFile(fileobj=binary_file, mode='wb') as gz_file:
+            return _write_csv_frames(frames, gz_file)
+    if fmt == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Export do Parquet vyžaduje balíček pyarrow") from e
+
+        writer = None
+        rows_written = 0
+        try:
+            for frame in frames:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    # Schéma prvního bloku; sloupec bez hodnot se z null typu převede na text
+                    schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                        for field in table.schema]).remove_metadata()
+                    writer = pq.ParquetWriter(binary_file, schema)
+                writer.write_table(table.cast(schema))
+                rows_written += len(frame)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows_written
+    raise ValueError(f"Neznámý formát stahování: {fmt}")
+
+
+def download_file(frames, fmt='csv'):
+    # Soubor ke stažení sestavený až na vyžádání; st.download_button z callable přijme jen bajty nebo text
+    buffer = io.BytesIO()
+    rows_written = write_frames(frames, buffer, fmt)
+    logger.info(f"Soubor ke stažení ({fmt}) připraven: {rows_written} řádků")
+    return buffer.getvalue()
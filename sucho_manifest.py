@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# Manifest zpracovaných rastrů: pro každý soubor datum, velikost, mtime, SHA-256 a výstupní sloupce.
+# Rastr se zpracuje znovu jen tehdy, když je nový, změnil se obsah nebo chybí jeho výstup.
+
+
+def manifest_path(output_folder):
+    return os.path.join(output_folder, MANIFEST_NAME)
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_current(manifest, raster_path):
+    entry = manifest.get(os.path.basename(raster_path))
+    if entry is None or not all(os.path.exists(path) for path in entry.get('output', [])):
+        return False
+    stat = os.stat(raster_path)
+    if stat.st_size != entry['size']:
+        return False
+    if stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+    # Změnilo se jen mtime (např. znovu stažený soubor) - rozhodne obsah
+    if file_sha256(raster_path) != entry['sha256']:
+        return False
+    entry['mtime_ns'] = stat.st_mtime_ns
+    return True
+
+
+def pending_rasters(manifest, raster_paths):
+    pending = [path for path in raster_paths if not is_current(manifest, path)]
+    logger.info(f"Ke zpracování {len(pending)} z {len(raster_paths)} rastrů")
+    return pending
+
+
+def record_raster(manifest, raster_path, date, output):
+    stat = os.stat(raster_path)
+    manifest[os.path.basename(raster_path)] = {
+        'date': date,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(raster_path),
+        'output': list(output),
+        'processed_at': datetime.now().isoformat(timespec='seconds'),
+    }
@@ -0,0 +1,141 @@
+import os
+import shutil
+import logging
+
+import numpy as np
+import pandas as pd
+
+import sucho_db
+import sucho_timing
+
+logger = logging.getLogger(__name__)
+
+MEAN_FILE = "mean.npy"
+MAJORITY_FILE = "majority.npy"
+PARCELS_FILE = "parcels.npy"
+DATES_FILE = "dates.npy"
+MISSING_MAJORITY = 255
+
+# Binární cache matice pozemky x data vedle databáze: <db>.matrix/<data_version>/.
+# mean.npy je float32, majority.npy uint8 (255 = chybí), parcels.npy seřazená pozemek_id
+# a dates.npy data YYYYMMDD. Soubory se čtou přes memmap, takže je všechny relace
+# sdílejí přes page cache operačního systému.
+
+
+def matrix_root(db_path):
+    return db_path + ".matrix"
+
+
+def matrix_dir(db_path, version):
+    return os.path.join(matrix_root(db_path), version)
+
+
+@sucho_timing.timed('matrix_write')
+def write_matrix(conn, db_path):
+    # Čtení v jedné transakci, aby verze a data odpovídaly stejnému stavu databáze
+    conn.execute("BEGIN")
+    try:
+        version = sucho_db.data_version(conn)
+        if version is None:
+            return None
+        target = matrix_dir(db_path, version)
+        if os.path.isdir(target):
+            return target
+
+        tmp_dir = f"{target}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        parcels = np.array([row[0] for row in conn.execute(
+            f"SELECT pozemek_id FROM {sucho_db.PARCEL_TABLE} ORDER BY pozemek_id")], dtype=np.int64)
+        dates = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT datum FROM {sucho_db.VALUES_TABLE} ORDER BY datum")]
+
+        shape = (len(parcels), len(dates))
+        mean = np.lib.format.open_memmap(os.path.join(tmp_dir, MEAN_FILE), mode='w+', dtype=np.float32, shape=shape)
+        majority = np.lib.format.open_memmap(os.path.join(tmp_dir, MAJORITY_FILE), mode='w+', dtype=np.uint8, shape=shape)
+        mean[:] = np.nan
+        majority[:] = MISSING_MAJORITY
+        for j, date in enumerate(dates):
+            rows = conn.execute(
+                f"SELECT pozemek_id, mean, majority FROM {sucho_db.VALUES_TABLE} WHERE datum = ?", (date,)).fetchall()
+            if not rows:
+                continue
+            values = np.array(rows, dtype=np.float64)
+            positions = np.searchsorted(parcels, values[:, 0].astype(np.int64))
+            mean[positions, j] = values[:, 1]
+            classes = values[:, 2]
+            majority[positions, j] = np.where(np.isnan(classes), MISSING_MAJORITY,
+                                              np.clip(classes, 0, MISSING_MAJORITY - 1)).astype(np.uint8)
+        mean.flush()
+        majority.flush()
+        del mean, majority
+        np.save(os.path.join(tmp_dir, PARCELS_FILE), parcels)
+        np.save(os.path.join(tmp_dir, DATES_FILE), np.array(dates, dtype='U8'))
+    finally:
+        conn.execute("COMMIT")
+
+    try:
+        os.replace(tmp_dir, target)
+    except OSError:
+        # Stejnou verzi mezitím zapsal jiný proces
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    _remove_old_versions(db_path, version)
+    logger.info(f"Matice pozemků zapsána: {shape[0]} x {shape[1]} -> {target}")
+    return target
+
+
+def _remove_old_versions(db_path, version):
+    root = matrix_root(db_path)
+    for name in os.listdir(root):
+        if name != version and not name.endswith('.tmp'):
+            # Na Windows se soubory otevřené jinou relací smazat nedají, zkusí se příště
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def ensure_matrix(db_path):
+    conn = sucho_db.connect(db_path)
+    try:
+        return write_matrix(conn, db_path)
+    finally:
+        conn.close()
+
+
+def open_matrix(db_path, version):
+    directory = matrix_dir(db_path, version) if version else None
+    if directory is None or not os.path.isdir(directory):
+        return None
+    return {
+        'mean': np.load(os.path.join(directory, MEAN_FILE), mmap_mode='r'),
+        'majority': np.load(os.path.join(directory, MAJORITY_FILE), mmap_mode='r'),
+        'parcels': np.load(os.path.join(directory, PARCELS_FILE)),
+        'dates': np.load(os.path.join(directory, DATES_FILE)),
+    }
+
+
+def _row_selector(rows):
+    # Souvislý úsek pozemků jde vzít jako řez (pohled bez kopie), jinak výběr řádků
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+        return slice(int(rows[0]), int(rows[-1]) + 1)
+    return rows
+
+
+def select(matrix, pozemek_ids, date_from=None, date_to=None, name='mean'):
+    dates = matrix['dates']
+    start = np.searchsorted(dates, date_from.strftime('%Y%m%d')) if date_from else 0
+    stop = np.searchsorted(dates, date_to.strftime('%Y%m%d'), side='right') if date_to else len(dates)
+
+    pozemek_ids = np.asarray(pozemek_ids, dtype=np.int64)
+    rows = np.searchsorted(matrix['parcels'], pozemek_ids)
+    found = rows < len(matrix['parcels'])
+    found[found] = matrix['parcels'][rows[found]] == pozemek_ids[found]
+    if not found.all():
+        return None, None
+    return matrix[name][_row_selector(rows), start:stop], dates[start:stop]
+
+
+def wide_frame(matrix, parcels, date_from=None, date_to=None):
+    # Stejný tvar jako sucho_db.query_wide, hodnoty jsou float32 pohledem do matice
+    values, dates = select(matrix, parcels['pozemek_id'].to_numpy(), date_from, date_to)
+    if values is None:
+        return None
+    matrix_df = pd.DataFrame(values, columns=[f"M_{date}" for date in dates], copy=False)
+    return pd.concat([parcels[sucho_db.KEY_COLUMNS].reset_index(drop=True), matrix_df], axis=1)
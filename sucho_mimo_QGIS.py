@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import logging
 
 # Nastavení cesty k QGIS Python knihovnám
 QGIS_PATH = r'D:\Program Files\QGIS 3.38.2\apps\qgis'
@@ -12,12 +13,24 @@ from qgis.core import (
     QgsVectorLayer,
     QgsRasterLayer,
     QgsField,
+    QgsFeatureRequest,
     QgsVectorFileWriter,
-    QgsCoordinateReferenceSystem
+    QgsCoordinateReferenceSystem,
+    NULL
 )
 from qgis.analysis import QgsZonalStatistics
 from PyQt5.QtCore import QVariant
 
+import sucho_db
+import sucho_export
+import sucho_manifest
+import sucho_matrix
+import sucho_store
+import sucho_timing
+
+# Úseky sucho_timing a hlášení modulů sucho_* jdou do logu jako JSON řádky
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
 def debug_print(message):
     print(f"[DEBUG] {time.strftime('%Y-%m-%d %H:%M:%S')} - {message}")
 
@@ -33,64 +46,103 @@ debug_print("QGIS aplikace inicializována")
 shapefile_path = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\SHP\VYBRANY_POZEMEK_TIF2.cpg.shp"
 raster_folder = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\Sucho-ze-serveru\2024_09_15"
 output_folder = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\Save\Output"
-result_shapefile_path = os.path.join(output_folder, "pozemky_aktualizovane.shp")
-mysql_output_file = os.path.join(output_folder, "pozemky_data.sql")
+store_folder = os.path.join(output_folder, "stats")
+# Vrstva s geometrií a sloupci M_/N_ se zapíše jen jednou na konci, a to jen když je potřeba.
+# GeoPackage nemá limit počtu polí jako DBF u shapefile.
+write_result_layer = False
+result_layer_path = os.path.join(output_folder, "pozemky_aktualizovane.gpkg")
+# Formát exportu: 'sql', 'sqlite', 'parquet' nebo 'csv'
+export_format = 'sql'
+mysql_output_file = os.path.join(output_folder, "pozemky_data" + sucho_export.EXTENSIONS[export_format])
+# Databáze prohlížeče, do které se doplní nově zpracovaná data (None = jen export)
+database_path = None
+manifest_file = sucho_manifest.manifest_path(output_folder)
 
 debug_print(f"Shapefile cesta: {shapefile_path}")
 debug_print(f"Rastrová složka: {raster_folder}")
 debug_print(f"Výstupní složka: {output_folder}")
-debug_print(f"Cesta k výslednému shapefile: {result_shapefile_path}")
+debug_print(f"Úložiště statistik: {store_folder}")
 debug_print(f"Cesta k MySQL výstupnímu souboru: {mysql_output_file}")
 
-def shapefile_exists(output_folder):
-    exists = os.path.exists(result_shapefile_path)
-    debug_print(f"Kontrola existence výsledného shapefile: {'Existuje' if exists else 'Neexistuje'}")
-    return exists
-
-def export_to_mysql(shapefile_path, output_sql_file):
-    debug_print(f"Začínám export do MySQL formátu: {output_sql_file}")
-    
-    layer = QgsVectorLayer(shapefile_path, "export_layer", "ogr")
-    if not layer.isValid():
-        debug_print("Chyba: Nelze načíst shapefile pro export do MySQL")
-        return
-
-    with open(output_sql_file, 'w', encoding='utf-8') as sql_file:
-        sql_file.write("CREATE TABLE IF NOT EXISTS pozemky_data (\n")
-        sql_file.write("  id INT AUTO_INCREMENT PRIMARY KEY,\n")
-        
-        fields = layer.fields()
-        for field in fields:
-            field_name = field.name()
-            field_type = field.typeName()
-            
-            if field_type == 'Integer':
-                sql_type = 'INT'
-            elif field_type == 'Real':
-                sql_type = 'DOUBLE'
-            else:
-                sql_type = 'VARCHAR(255)'
-            
-            sql_file.write(f"  {field_name} {sql_type},\n")
-        
-        sql_file.write(");\n\n")
-        
-        for feature in layer.getFeatures():
-            attributes = feature.attributes()
-            columns = ', '.join(field.name() for field in fields)
-            values = ', '.join("'" + str(attr).replace("'", "''") + "'" for attr in attributes)
-            sql_file.write(f"INSERT INTO pozemky_data ({columns}) VALUES ({values});\n")
-
-    debug_print(f"Export do MySQL formátu dokončen: {output_sql_file}")
-
-# Procházení všech rastrových souborů ve složce
+# Prefix dočasných polí zonálních statistik v paměťové vrstvě
+ZONAL_PREFIX = "ZS_"
+
+def take_zonal_field(layer, field_name):
+    # Přečte hodnoty pole v pořadí prvků a pole z paměťové vrstvy odebere
+    idx = layer.fields().indexFromName(field_name)
+    values = [feature.attributes()[idx] for feature in layer.getFeatures()]
+    layer.dataProvider().deleteAttributes([idx])
+    layer.updateFields()
+    return [float('nan') if value is None or value == NULL else float(value) for value in values]
+
+def export_to_mysql(store_folder, fields, attribute_rows, output_sql_file, fmt='sql'):
+    debug_print(f"Začínám export do formátu {fmt}: {output_sql_file}")
+
+    dates = sucho_store.stored_dates(store_folder)
+    rows = sucho_store.iter_export_rows(store_folder, attribute_rows, dates)
+    with sucho_timing.span('export', format=fmt) as current:
+        row_count = sucho_export.export_table(sucho_store.export_fields(fields, dates), rows, output_sql_file, fmt)
+        current.record(rows=row_count, nbytes=os.path.getsize(output_sql_file))
+
+    debug_print(f"Export do formátu {fmt} dokončen: {output_sql_file} ({row_count} řádků)")
+
+def write_result_layer_once(polygon_layer, store_folder, output_path):
+    debug_print(f"Zapisuji výslednou vrstvu s geometrií: {output_path}")
+    dates = sucho_store.stored_dates(store_folder)
+    provider = polygon_layer.dataProvider()
+    first_new = polygon_layer.fields().count()
+    new_fields = []
+    for date in dates:
+        new_fields += [QgsField(f"M_{date}", QVariant.Double), QgsField(f"N_{date}", QVariant.Int)]
+    provider.addAttributes(new_fields)
+    polygon_layer.updateFields()
+
+    columns = [sucho_store.read_date(store_folder, date) for date in dates]
+    changes = {}
+    for i, feature in enumerate(polygon_layer.getFeatures()):
+        values = {}
+        for j, (mean, majority) in enumerate(columns):
+            values[first_new + 2 * j] = None if mean[i] != mean[i] else float(mean[i])
+            values[first_new + 2 * j + 1] = None if majority[i] != majority[i] else int(majority[i])
+        changes[feature.id()] = values
+    provider.changeAttributeValues(changes)
+
+    error = QgsVectorFileWriter.writeAsVectorFormat(polygon_layer, output_path, "utf-8", polygon_layer.crs(), "GPKG")
+    if error == QgsVectorFileWriter.NoError:
+        debug_print(f"Výsledná vrstva byla úspěšně uložena do: {output_path}")
+    else:
+        debug_print("CHYBA: Při ukládání výsledné vrstvy došlo k chybě")
+
+# Pozemky se načtou jednou do paměťové vrstvy, zonální statistiky už nezapisují na disk
+source_layer = QgsVectorLayer(shapefile_path, "Polygon Layer", "ogr")
+if not source_layer.isValid():
+    debug_print(f"CHYBA: Shapefile vrstva {shapefile_path} je neplatná!")
+    qgs.exitQgis()
+    sys.exit(1)
+
+polygon_layer = source_layer.materialize(QgsFeatureRequest())
+fields = [(field.name(), sucho_export.field_kind(field.typeName())) for field in source_layer.fields()]
+attribute_rows = []
+parcel_ids = []
+for feature in polygon_layer.getFeatures():
+    attribute_rows.append(tuple(None if attr == NULL else attr for attr in feature.attributes()))
+    parcel_ids.append(feature.id())
+sucho_store.open_store(store_folder, parcel_ids)
+debug_print(f"Načteno {len(parcel_ids)} pozemků")
+
+# Procházení rastrových souborů ve složce; zpracují se jen nové nebo změněné podle manifestu
 raster_files = [f for f in sorted(os.listdir(raster_folder)) if f.endswith(".tif")]
 debug_print(f"Nalezeno {len(raster_files)} rastrových souborů")
+manifest = sucho_manifest.load_manifest(manifest_file)
+raster_files = [f for f in raster_files if not sucho_manifest.is_current(manifest, os.path.join(raster_folder, f))]
+debug_print(f"Ke zpracování {len(raster_files)} nových nebo změněných rastrů")
+processed_dates = []
 
 for index, raster_file in enumerate(raster_files, 1):
     debug_print(f"Zpracovávám rastr {index}/{len(raster_files)}: {raster_file}")
     raster_path = os.path.join(raster_folder, raster_file)
-    raster_layer = QgsRasterLayer(raster_path, raster_file)
+    with sucho_timing.span('raster_load', raster=raster_file, nbytes=os.path.getsize(raster_path)):
+        raster_layer = QgsRasterLayer(raster_path, raster_file)
 
     if not raster_layer.isValid():
         debug_print(f"CHYBA: Rastrová vrstva {raster_path} je neplatná!")
@@ -100,52 +152,39 @@ for index, raster_file in enumerate(raster_files, 1):
     raster_number = raster_base_name.split('_')[-1]
     debug_print(f"Extrahované číslo rastru: {raster_number}")
 
-    if not shapefile_exists(output_folder):
-        debug_print("Používám původní shapefile")
-        polygon_layer = QgsVectorLayer(shapefile_path, "Polygon Layer", "ogr")
-    else:
-        debug_print("Používám existující výsledný shapefile")
-        polygon_layer = QgsVectorLayer(result_shapefile_path, "Polygon Layer", "ogr")
-
-    if not polygon_layer.isValid():
-        debug_print(f"CHYBA: Shapefile vrstva {polygon_layer.sourceName()} je neplatná!")
-        continue
-
     debug_print("Počítám zonální statistiky")
-    mean_stats = QgsZonalStatistics(polygon_layer, raster_layer, '', 1, QgsZonalStatistics.Mean)
-    mean_stats.calculateStatistics(None)
-
-    majority_stats = QgsZonalStatistics(polygon_layer, raster_layer, '', 1, QgsZonalStatistics.Majority)
-    majority_stats.calculateStatistics(None)
-
-    debug_print("Přejmenovávám sloupce")
-    polygon_layer.startEditing()
-    fields = polygon_layer.fields()
-    
-    for field in fields:
-        if "mean" in field.name().lower():
-            idx = polygon_layer.fields().indexFromName(field.name())
-            new_name = f'M_{raster_number}'
-            polygon_layer.renameAttribute(idx, new_name)
-            debug_print(f"Přejmenován sloupec: {field.name()} -> {new_name}")
-        elif "majority" in field.name().lower():
-            idx = polygon_layer.fields().indexFromName(field.name())
-            new_name = f'N_{raster_number}'
-            polygon_layer.renameAttribute(idx, new_name)
-            debug_print(f"Přejmenován sloupec: {field.name()} -> {new_name}")
-    
-    polygon_layer.commitChanges()
-
-    debug_print("Ukládám aktualizovaný shapefile")
-    error = QgsVectorFileWriter.writeAsVectorFormat(polygon_layer, result_shapefile_path, "utf-8", polygon_layer.crs(), "ESRI Shapefile")
-
-    if error == QgsVectorFileWriter.NoError:
-        debug_print(f"Výsledný shapefile byl úspěšně uložen do: {result_shapefile_path}")
-    else:
-        debug_print(f"CHYBA: Při ukládání shapefile pro {raster_file} došlo k chybě")
-
-debug_print("Exportuji data do MySQL formátu")
-export_to_mysql(result_shapefile_path, mysql_output_file)
+    with sucho_timing.profiled('zonal_stats', rows=len(parcel_ids), date=raster_number):
+        mean_stats = QgsZonalStatistics(polygon_layer, raster_layer, ZONAL_PREFIX, 1, QgsZonalStatistics.Mean)
+        mean_stats.calculateStatistics(None)
+
+        majority_stats = QgsZonalStatistics(polygon_layer, raster_layer, ZONAL_PREFIX, 1, QgsZonalStatistics.Majority)
+        majority_stats.calculateStatistics(None)
+
+    debug_print(f"Ukládám sloupce M_{raster_number} a N_{raster_number} do úložiště")
+    with sucho_timing.span('rename', rows=len(parcel_ids), date=raster_number):
+        mean_values = take_zonal_field(polygon_layer, f"{ZONAL_PREFIX}mean")
+        majority_values = take_zonal_field(polygon_layer, f"{ZONAL_PREFIX}majority")
+    with sucho_timing.span('write', rows=len(parcel_ids), date=raster_number):
+        output = sucho_store.append_date(store_folder, raster_number, mean_values, majority_values)
+    sucho_manifest.record_raster(manifest, raster_path, raster_number, output)
+    sucho_manifest.save_manifest(manifest, manifest_file)
+    processed_dates.append(raster_number)
+
+if write_result_layer:
+    write_result_layer_once(polygon_layer, store_folder, result_layer_path)
+
+if processed_dates or not os.path.exists(mysql_output_file):
+    debug_print("Exportuji data do MySQL formátu")
+    previous_fingerprint = sucho_db.file_fingerprint(mysql_output_file) if os.path.exists(mysql_output_file) else None
+    export_to_mysql(store_folder, fields, attribute_rows, mysql_output_file, export_format)
+    if database_path and export_format == 'sql':
+        columns = {date: sucho_store.read_date(store_folder, date) for date in processed_dates}
+        with sucho_timing.span('db_sync', dates=len(columns)):
+            if sucho_db.sync_database(database_path, columns, previous_fingerprint, mysql_output_file):
+                sucho_matrix.ensure_matrix(database_path)
+                sucho_db.ensure_trends(database_path)
+else:
+    debug_print("Žádná nová data, export je aktuální")
 
 debug_print("Ukončuji QGIS aplikaci")
 qgs.exitQgis()
@@ -0,0 +1,183 @@
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from osgeo import ogr
+
+import sucho_db
+import sucho_export
+import sucho_manifest
+import sucho_matrix
+import sucho_store
+import sucho_timing
+import sucho_zonal
+
+# Nastavení logování
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Cesty k souborům a složkám
+shapefile_path = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\SHP\VYBRANY_POZEMEK_TIF2.cpg.shp"
+raster_folder = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\Sucho-ze-serveru\2024_09_15"
+output_folder = r"D:\OneDrive - CZU v Praze\SPS\Projekty\Agrometeorologie_cz\Sucho\Data\Save\Output"
+export_format = 'sql'
+# Počet pracovních procesů pro zpracování dat (1 = sekvenčně)
+workers = os.cpu_count() or 1
+# Databáze prohlížeče, do které se doplní nově zpracovaná data (None = jen export)
+database_path = None
+
+
+def raster_date(raster_file):
+    # SUCHO_20240326.tif -> 20240326 (stejně jako v sucho_mimo_QGIS.py)
+    return os.path.splitext(os.path.basename(raster_file))[0].split('_')[-1]
+
+
+def list_rasters(raster_folder):
+    return [os.path.join(raster_folder, f) for f in sorted(os.listdir(raster_folder)) if f.endswith(".tif")]
+
+
+def read_parcel_attributes(shapefile_path):
+    # Atributy pozemků v pořadí prvků vrstvy (stejné pořadí jako v LabelGrid)
+    ds = ogr.Open(shapefile_path)
+    if ds is None:
+        raise IOError(f"Nelze otevřít soubor: {shapefile_path}")
+    layer = ds.GetLayer()
+    layer_defn = layer.GetLayerDefn()
+    field_defns = [layer_defn.GetFieldDefn(i) for i in range(layer_defn.GetFieldCount())]
+    fields = [(defn.GetName(), sucho_export.field_kind(defn.GetTypeName())) for defn in field_defns]
+    rows = []
+    fids = []
+    for feature in layer:
+        rows.append(tuple(feature.GetField(i) for i in range(len(fields))))
+        fids.append(feature.GetFID())
+    return fields, rows, fids
+
+
+def compute_date_statistics(shapefile_path, raster_path, label_grids, cache_dir=None):
+    grid = sucho_zonal.raster_grid(raster_path)
+    key = sucho_zonal.grid_key(shapefile_path, grid)
+    if key not in label_grids:
+        label_grids[key] = sucho_zonal.load_label_grid(shapefile_path, grid, cache_dir)
+    return sucho_zonal.raster_statistics(label_grids[key], raster_path)
+
+
+# Mřížky pozemků načtené v pracovním procesu, sdílené mezi daty, která proces zpracuje
+_worker_label_grids = {}
+
+
+def _process_raster(shapefile_path, raster_path, cache_dir):
+    stats = compute_date_statistics(shapefile_path, raster_path, _worker_label_grids, cache_dir)
+    return raster_date(raster_path), stats['mean'], stats['majority']
+
+
+def _process_sequential(shapefile_path, raster_paths, store_dir, cache_dir):
+    processed = []
+    failed = []
+    label_grids = {}
+    for index, raster_path in enumerate(raster_paths, 1):
+        date = raster_date(raster_path)
+        started = time.perf_counter()
+        try:
+            stats = compute_date_statistics(shapefile_path, raster_path, label_grids, cache_dir)
+        except Exception as e:
+            logger.error(f"Rastr {raster_path} se nepodařilo zpracovat: {e}")
+            failed.append((raster_path, str(e)))
+            continue
+        with sucho_timing.span('write', rows=len(stats['mean']), date=date):
+            output = sucho_store.append_date(store_dir, date, stats['mean'], stats['majority'])
+        processed.append((raster_path, date, output))
+        logger.info(f"Rastr {index}/{len(raster_paths)} ({date}) zpracován za {time.perf_counter() - started:.2f} s")
+    return processed, failed
+
+
+def _process_parallel(shapefile_path, raster_paths, store_dir, cache_dir, workers):
+    # Mřížku pozemků pro první rastr připraví hlavní proces, aby ji procesy nerasterizovaly souběžně
+    try:
+        sucho_zonal.load_label_grid(shapefile_path, sucho_zonal.raster_grid(raster_paths[0]), cache_dir)
+    except Exception as e:
+        logger.warning(f"Předpřipravení mřížky pozemků selhalo: {e}")
+
+    processed = []
+    failed = []
+    done = 0
+    # spawn: GDAL nesnáší fork s otevřenými datasety
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(_process_raster, shapefile_path, raster_path, cache_dir): raster_path
+                   for raster_path in raster_paths}
+        for future in as_completed(futures):
+            raster_path = futures[future]
+            done += 1
+            try:
+                date, mean, majority = future.result()
+            except Exception as e:
+                logger.error(f"Rastr {raster_path} se nepodařilo zpracovat: {e}")
+                failed.append((raster_path, str(e)))
+                continue
+            # Každé datum má v úložišti vlastní sloupce, pořadí dokončení výsledek neovlivní
+            with sucho_timing.span('write', rows=len(mean), date=date):
+                output = sucho_store.append_date(store_dir, date, mean, majority)
+            processed.append((raster_path, date, output))
+            logger.info(f"Rastr {done}/{len(raster_paths)} ({date}) zpracován")
+    return sorted(processed), sorted(failed)
+
+
+def export_store(store_dir, fields, rows, output_path, export_format='sql'):
+    dates = sucho_store.stored_dates(store_dir)
+    with sucho_timing.span('export', format=export_format) as current:
+        row_count = sucho_export.export_table(sucho_store.export_fields(fields, dates),
+                                              sucho_store.iter_export_rows(store_dir, rows, dates),
+                                              output_path, export_format)
+        current.record(rows=row_count, nbytes=os.path.getsize(output_path))
+    return output_path
+
+
+def run(shapefile_path, raster_folder, output_folder, export_format='sql', workers=1, database_path=None):
+    os.makedirs(output_folder, exist_ok=True)
+    cache_dir = os.path.join(output_folder, "cache")
+    store_dir = os.path.join(output_folder, "stats")
+    output_path = os.path.join(output_folder, "pozemky_data" + sucho_export.EXTENSIONS[export_format])
+    fields, rows, fids = read_parcel_attributes(shapefile_path)
+    sucho_store.open_store(store_dir, fids)
+    logger.info(f"Načteno {len(rows)} pozemků z {shapefile_path}")
+
+    manifest_file = sucho_manifest.manifest_path(output_folder)
+    manifest = sucho_manifest.load_manifest(manifest_file)
+    raster_paths = list_rasters(raster_folder)
+    logger.info(f"Nalezeno {len(raster_paths)} rastrových souborů, {workers} procesů")
+    raster_paths = sucho_manifest.pending_rasters(manifest, raster_paths)
+
+    if workers > 1 and len(raster_paths) > 1:
+        processed, failed = _process_parallel(shapefile_path, raster_paths, store_dir, cache_dir, workers)
+    else:
+        processed, failed = _process_sequential(shapefile_path, raster_paths, store_dir, cache_dir)
+
+    for raster_path, date, output in processed:
+        sucho_manifest.record_raster(manifest, raster_path, date, output)
+    sucho_manifest.save_manifest(manifest, manifest_file)
+
+    if failed:
+        logger.warning(f"Nezpracováno {len(failed)} rastrů: " + ", ".join(os.path.basename(path) for path, _ in failed))
+
+    if not processed and os.path.exists(output_path):
+        logger.info("Žádná nová data, export je aktuální")
+        return output_path, failed
+
+    previous_fingerprint = sucho_db.file_fingerprint(output_path) if os.path.exists(output_path) else None
+    export_store(store_dir, fields, rows, output_path, export_format)
+    if database_path and export_format == 'sql':
+        columns = {date: sucho_store.read_date(store_dir, date) for _, date, _ in processed}
+        with sucho_timing.span('db_sync', dates=len(columns)):
+            if sucho_db.sync_database(database_path, columns, previous_fingerprint, output_path):
+                sucho_matrix.ensure_matrix(database_path)
+                sucho_db.ensure_trends(database_path)
+    return output_path, failed
+
+
+if __name__ == "__main__":
+    logging.info("Začátek zpracování")
+    with sucho_timing.profiled('pipeline_run'):
+        run(shapefile_path, raster_folder, output_folder, export_format, workers, database_path)
+    logging.info("Zpracování dokončeno")
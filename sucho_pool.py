@@ -0,0 +1,54 @@
+import queue
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = 8
+# Nastavení čtecích spojení: 64 MB page cache na spojení, soubor databáze namapovaný do paměti (sdílený přes page cache OS)
+READ_PRAGMAS = (
+    "PRAGMA query_only=ON",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=1073741824",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Sdílená sada čtecích spojení pro všechny relace procesu. Databáze musí být v režimu WAL
+# (sucho_db.connect), pak čtenáři neblokují sebe navzájem ani import; zápis probíhá
+# výhradně přes sucho_db (build_database, sync_database) na samostatném spojení.
+
+
+class ConnectionPool:
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(self._open())
+
+    def _open(self):
+        # Autocommit: každý dotaz má vlastní krátký snapshot, spojení nedrží WAL před checkpointem
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Zapůjčí volné spojení; když jsou všechna obsazená, čeká na vrácení prvního z nich
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
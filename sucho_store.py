@@ -0,0 +1,93 @@
+import os
+import re
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PARCELS_FILE = "parcels.npy"
+_COLUMN_RE = re.compile(r"^M_(\w+)\.npy$")
+
+# Sloupcové úložiště statistik: parcels.npy s ID pozemků a pro každé datum
+# dva soubory M_<datum>.npy (průměr) a N_<datum>.npy (majorita) zarovnané na parcels.npy.
+# Zpracování jednoho data zapíše jen své dva sloupce, bez ohledu na počet předchozích dat.
+
+
+def open_store(store_dir, parcel_ids):
+    os.makedirs(store_dir, exist_ok=True)
+    parcel_ids = np.asarray(parcel_ids, dtype=np.int64)
+    parcels_path = os.path.join(store_dir, PARCELS_FILE)
+    if os.path.exists(parcels_path):
+        stored = np.load(parcels_path)
+        if not np.array_equal(stored, parcel_ids):
+            raise ValueError(f"Úložiště {store_dir} patří k jiné vrstvě pozemků, smažte ho nebo použijte jiné")
+    else:
+        _save_atomic(parcels_path, parcel_ids)
+    return store_dir
+
+
+def _save_atomic(path, array):
+    # Zápis přes dočasný soubor, aby přerušený běh nezanechal poškozený sloupec
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def parcel_ids(store_dir):
+    return np.load(os.path.join(store_dir, PARCELS_FILE))
+
+
+def date_paths(store_dir, date):
+    return os.path.join(store_dir, f"M_{date}.npy"), os.path.join(store_dir, f"N_{date}.npy")
+
+
+def append_date(store_dir, date, mean, majority):
+    n = len(parcel_ids(store_dir))
+    mean = np.asarray(mean, dtype=np.float64)
+    majority = np.asarray(majority, dtype=np.float64)
+    if len(mean) != n or len(majority) != n:
+        raise ValueError(f"Statistiky pro {date} nemají {n} hodnot")
+    mean_path, majority_path = date_paths(store_dir, date)
+    # Majorita se ukládá před průměrem: stored_dates hledá podle M_, takže datum je vidět až s oběma sloupci
+    _save_atomic(majority_path, majority)
+    _save_atomic(mean_path, mean)
+    return mean_path, majority_path
+
+
+def stored_dates(store_dir):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(m.group(1) for m in map(_COLUMN_RE.match, os.listdir(store_dir)) if m)
+
+
+def read_date(store_dir, date):
+    mean_path, majority_path = date_paths(store_dir, date)
+    return np.load(mean_path, mmap_mode='r'), np.load(majority_path, mmap_mode='r')
+
+
+def export_fields(fields, dates):
+    out_fields = list(fields)
+    for date in dates:
+        out_fields += [(f"M_{date}", 'real'), (f"N_{date}", 'int')]
+    return out_fields
+
+
+def iter_export_rows(store_dir, attribute_rows, dates=None, chunk_size=1000):
+    # Řádky pro sucho_export: atributy pozemku + M_/N_ pro každé datum, čtené po blocích pozemků
+    dates = stored_dates(store_dir) if dates is None else dates
+    columns = [read_date(store_dir, date) for date in dates]
+    attribute_rows = list(attribute_rows)
+    if len(attribute_rows) != len(parcel_ids(store_dir)):
+        raise ValueError("Počet atributových řádků neodpovídá počtu pozemků v úložišti")
+
+    for start in range(0, len(attribute_rows), chunk_size):
+        stop = start + chunk_size
+        block = [(np.asarray(mean[start:stop]), np.asarray(majority[start:stop])) for mean, majority in columns]
+        for offset, row in enumerate(attribute_rows[start:stop]):
+            values = list(row)
+            for mean, majority in block:
+                values.append(mean[offset])
+                values.append(None if np.isnan(majority[offset]) else int(majority[offset]))
+            yield tuple(values)
@@ -0,0 +1,180 @@
+import io
+import os
+import json
+import time
+import uuid
+import pstats
+import logging
+import cProfile
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+
+logger = logging.getLogger("sucho.timing")
+
+# Pojmenované úseky (spany) s délkou, počtem řádků a bajtů. Každý dokončený úsek se zapíše
+# jako jeden JSON řádek do loggeru sucho.timing a uloží do krátké historie pro diagnostický panel.
+# Vnořené úseky sdílejí trace (jeden požadavek prohlížeče nebo jeden běh skriptu) a znají rodiče.
+#
+# Profilování je volitelné: SUCHO_PROFILE=1 spustí cProfile a SUCHO_TRACEMALLOC=1 sledování paměti
+# v úsecích otevřených přes profiled(). Výpis profilu jde do logu, s SUCHO_PROFILE_DIR i do .prof souboru.
+
+RECENT_SPANS = 1000
+PROFILE_TOP = 25
+
+_current = ContextVar('sucho_span', default=None)
+_recent = deque(maxlen=RECENT_SPANS)
+_recent_lock = Lock()
+_profiles = deque(maxlen=20)
+_profile_lock = Lock()
+
+
+class Span:
+
+    def __init__(self, name, parent=None, **fields):
+        self.name = name
+        self.parent = parent
+        self.trace = parent.trace if parent is not None else uuid.uuid4().hex[:12]
+        self.path = f"{parent.path}/{name}" if parent is not None else name
+        self.rows = None
+        self.bytes = None
+        self.fields = fields
+        self.started_at = time.time()
+        self.duration = None
+
+    def record(self, rows=None, nbytes=None, **fields):
+        # Doplnění počtu řádků, bajtů a dalších údajů během úseku
+        if rows is not None:
+            self.rows = int(rows)
+        if nbytes is not None:
+            self.bytes = int(nbytes)
+        self.fields.update(fields)
+        return self
+
+    def as_dict(self):
+        entry = {
+            'span': self.name,
+            'path': self.path,
+            'trace': self.trace,
+            'started_at': round(self.started_at, 3),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'rows': self.rows,
+            'bytes': self.bytes,
+        }
+        entry.update(self.fields)
+        return entry
+
+
+def frame_size(df):
+    # (řádky, bajty) DataFrame bez hlubokého procházení textových sloupců
+    return len(df), int(df.memory_usage(index=False, deep=False).sum())
+
+
+@contextmanager
+def span(name, rows=None, nbytes=None, **fields):
+    parent = _current.get()
+    current = Span(name, parent, **fields).record(rows, nbytes)
+    token = _current.set(current)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current.reset(token)
+        if error is not None:
+            current.fields['error'] = error
+        entry = current.as_dict()
+        with _recent_lock:
+            _recent.append(entry)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+def timed(name=None):
+    # Dekorátor: celé volání funkce jako jeden úsek
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiling_enabled():
+    return os.environ.get('SUCHO_PROFILE') == '1', os.environ.get('SUCHO_TRACEMALLOC') == '1'
+
+
+@contextmanager
+def profiled(name, **fields):
+    # Úsek, který při zapnutém profilování sbírá i cProfile a špičku alokované paměti.
+    # Profiluje vždy jen jeden úsek v procesu: cProfile nejde zapnout souběžně ve více vláknech
+    # a tracemalloc je globální, takže ostatní úseky (i vnořené) běží během toho bez profilování.
+    use_profile, use_tracemalloc = profiling_enabled()
+    if not (use_profile or use_tracemalloc) or not _profile_lock.acquire(blocking=False):
+        with span(name, **fields) as current:
+            yield current
+        return
+
+    try:
+        profiler = cProfile.Profile() if use_profile else None
+        started_tracing = use_tracemalloc and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if use_tracemalloc:
+            tracemalloc.reset_peak()
+
+        with span(name, **fields) as current:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield current
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                if use_tracemalloc:
+                    current.record(peak_bytes=tracemalloc.get_traced_memory()[1])
+                    if started_tracing:
+                        tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+
+    if profiler is not None:
+        _store_profile(current, profiler)
+
+
+def _store_profile(current, profiler):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    report = output.getvalue()
+    _profiles.append({'trace': current.trace, 'span': current.name, 'report': report})
+    logger.info(json.dumps({'profile': current.name, 'trace': current.trace, 'report': report}, ensure_ascii=False))
+
+    profile_dir = os.environ.get('SUCHO_PROFILE_DIR')
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, f"{current.name}_{current.trace}.prof"))
+
+
+def recent_spans(trace=None):
+    with _recent_lock:
+        entries = list(_recent)
+    if trace is not None:
+        entries = [entry for entry in entries if entry['trace'] == trace]
+    return entries
+
+
+def recent_profile(trace):
+    for entry in reversed(_profiles):
+        if entry['trace'] == trace:
+            return entry['report']
+    return None
@@ -0,0 +1,309 @@
+import os
+import math
+import hashlib
+import logging
+from collections import namedtuple
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+import sucho_timing
+
+logger = logging.getLogger(__name__)
+
+LABEL_FIELD = "SUCHO_LBL"
+# Nad tento počet tříd se majorita počítá přes unikátní dvojice místo bincount
+MAX_MAJORITY_CLASSES = 4096
+# Když je okno přes rozsah všech pozemků tolikrát větší než součet oken jednotlivých pozemků
+# (pozemky rozptýlené po republice), čtou se okna pozemků zvlášť
+PARCEL_WINDOW_RATIO = 4
+
+# Předpočítaný rozpad pozemků na pixely rastru v okně (xoff, yoff, xsize, ysize):
+# pixel_index jsou indexy do zploštělého okna, pixel_label pořadí pozemku (0..n-1).
+# Jeden pixel může patřit více pozemkům (překryvy, malé pozemky přes ALL_TOUCHED).
+LabelGrid = namedtuple('LabelGrid', ['fids', 'window', 'pixel_index', 'pixel_label', 'order', 'starts', 'segment_labels'])
+
+
+def raster_grid(raster_path):
+    ds = gdal.Open(raster_path)
+    if ds is None:
+        raise IOError(f"Nelze otevřít rastr: {raster_path}")
+    return {
+        'geotransform': tuple(ds.GetGeoTransform()),
+        'projection': ds.GetProjection(),
+        'xsize': ds.RasterXSize,
+        'ysize': ds.RasterYSize,
+    }
+
+
+def grid_key(shapefile_path, grid):
+    # Mřížka se mění jen se změnou vrstvy pozemků nebo geometrie rastru, ne s datem
+    stat = os.stat(shapefile_path)
+    signature = repr((os.path.abspath(shapefile_path), stat.st_size, stat.st_mtime_ns,
+                      grid['geotransform'], grid['projection'], grid['xsize'], grid['ysize']))
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16]
+
+
+def extent_window(extent, geotransform, xsize, ysize):
+    # Pixelové okno rastru pokrývající rozsah (minx, maxx, miny, maxy)
+    gt = geotransform
+    if gt[2] or gt[4]:
+        return 0, 0, xsize, ysize
+    minx, maxx, miny, maxy = extent
+    cols = sorted(((minx - gt[0]) / gt[1], (maxx - gt[0]) / gt[1]))
+    rows = sorted(((maxy - gt[3]) / gt[5], (miny - gt[3]) / gt[5]))
+    xoff = min(max(int(math.floor(cols[0])), 0), xsize)
+    yoff = min(max(int(math.floor(rows[0])), 0), ysize)
+    xend = min(max(int(math.ceil(cols[1])), 0), xsize)
+    yend = min(max(int(math.ceil(rows[1])), 0), ysize)
+    return xoff, yoff, xend - xoff, yend - yoff
+
+
+def _window_geotransform(geotransform, window):
+    gt = geotransform
+    xoff, yoff = window[0], window[1]
+    return (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+            gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+
+
+def _rasterize(layer, grid, window, options):
+    target = gdal.GetDriverByName('MEM').Create('', window[2], window[3], 1, gdal.GDT_Int32)
+    target.SetGeoTransform(_window_geotransform(grid['geotransform'], window))
+    target.SetProjection(grid['projection'])
+    gdal.RasterizeLayer(target, [1], layer, options=[f'ATTRIBUTE={LABEL_FIELD}'] + options)
+    return target.GetRasterBand(1).ReadAsArray().ravel()
+
+
+def _label_layer(shapefile_path, grid):
+    # Kopie pozemků do paměti s pořadovým číslem a v souřadnicovém systému rastru
+    src_ds = ogr.Open(shapefile_path)
+    if src_ds is None:
+        raise IOError(f"Nelze otevřít soubor: {shapefile_path}")
+    src_layer = src_ds.GetLayer()
+
+    raster_srs = osr.SpatialReference()
+    raster_srs.ImportFromWkt(grid['projection'])
+    layer_srs = src_layer.GetSpatialRef()
+    transform = None
+    if layer_srs is not None and grid['projection'] and not layer_srs.IsSame(raster_srs):
+        layer_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        raster_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(layer_srs, raster_srs)
+
+    mem_ds = ogr.GetDriverByName('Memory').CreateDataSource('labels')
+    mem_layer = mem_ds.CreateLayer('labels', srs=raster_srs, geom_type=ogr.wkbUnknown)
+    mem_layer.CreateField(ogr.FieldDefn(LABEL_FIELD, ogr.OFTInteger))
+
+    fids = []
+    for i, feature in enumerate(src_layer):
+        fids.append(feature.GetFID())
+        geom = feature.GetGeometryRef()
+        if geom is None:
+            continue
+        geom = geom.Clone()
+        if transform is not None:
+            geom.Transform(transform)
+        out = ogr.Feature(mem_layer.GetLayerDefn())
+        out.SetGeometry(geom)
+        out.SetField(LABEL_FIELD, i + 1)
+        mem_layer.CreateFeature(out)
+
+    return mem_ds, mem_layer, np.asarray(fids, dtype=np.int64)
+
+
+def _finish_grid(fids, window, pixel_index, pixel_label):
+    # Pořadí pixelů podle pozemku je pro všechna data stejné, třídí se jen jednou
+    order = np.argsort(pixel_label, kind='stable')
+    sorted_labels = pixel_label[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) if len(order) else np.empty(0, np.int64)
+    segment_labels = sorted_labels[starts] if len(order) else np.empty(0, np.int32)
+    return LabelGrid(fids, tuple(int(v) for v in window), pixel_index, pixel_label, order, starts, segment_labels)
+
+
+@sucho_timing.timed('label_grid')
+def build_label_grid(shapefile_path, grid):
+    mem_ds, mem_layer, fids = _label_layer(shapefile_path, grid)
+    window = extent_window(mem_layer.GetExtent(), grid['geotransform'], grid['xsize'], grid['ysize'])
+
+    if window[2] == 0 or window[3] == 0 or len(fids) == 0:
+        logger.warning(f"Pozemky z {shapefile_path} se nepřekrývají s rastrem")
+        empty = np.empty(0, np.int64)
+        return _finish_grid(fids, window, empty, empty.astype(np.int32))
+
+    # Pixely se středem uvnitř pozemku (stejně jako rasterizace v QGIS)
+    labels = _rasterize(mem_layer, grid, window, [])
+    pixel_index = np.flatnonzero(labels)
+    pixel_label = labels[pixel_index] - 1
+
+    # Pozemky menší než pixel dostanou pixely, kterých se dotýkají
+    missing = np.setdiff1d(np.arange(len(fids)), pixel_label)
+    if len(missing):
+        mem_layer.SetAttributeFilter(f"{LABEL_FIELD} IN ({','.join(str(i + 1) for i in missing)})")
+        touched = _rasterize(mem_layer, grid, window, ['ALL_TOUCHED=TRUE'])
+        mem_layer.SetAttributeFilter(None)
+        extra = np.flatnonzero(touched)
+        pixel_index = np.concatenate([pixel_index, extra])
+        pixel_label = np.concatenate([pixel_label, touched[extra] - 1])
+
+    logger.info(f"Mřížka pozemků: {len(fids)} pozemků, {len(pixel_index)} pixelů, okno {window}")
+    return _finish_grid(fids, window, pixel_index.astype(np.int64), pixel_label.astype(np.int32))
+
+
+def load_label_grid(shapefile_path, grid, cache_dir=None):
+    # Rasterizace pozemků proběhne jednou pro danou mřížku rastru, dále se čte z cache
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, f"labels_{grid_key(shapefile_path, grid)}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                return _finish_grid(cached['fids'], cached['window'], cached['pixel_index'], cached['pixel_label'])
+
+    label_grid = build_label_grid(shapefile_path, grid)
+    if cache_path:
+        # Zápis přes dočasný soubor, cache může číst souběžně jiný proces
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, fids=label_grid.fids, window=np.asarray(label_grid.window),
+                     pixel_index=label_grid.pixel_index, pixel_label=label_grid.pixel_label)
+        os.replace(tmp_path, cache_path)
+    return label_grid
+
+
+@sucho_timing.timed('raster_load')
+def read_window(raster_path, window, band_number=1):
+    ds = gdal.Open(raster_path)
+    if ds is None:
+        raise IOError(f"Nelze otevřít rastr: {raster_path}")
+    band = ds.GetRasterBand(band_number)
+    values = band.ReadAsArray(*window) if window[2] and window[3] else np.empty((0, 0))
+    return values, band.GetNoDataValue()
+
+
+def _majority(labels, values, n):
+    majority = np.full(n, np.nan)
+    if not len(values):
+        return majority
+    classes = np.rint(values)
+    low, high = classes.min(), classes.max()
+    span = int(high - low) + 1
+    if np.array_equal(classes, values) and span <= MAX_MAJORITY_CLASSES:
+        counts = np.bincount(labels.astype(np.int64) * span + (classes - low).astype(np.int64),
+                             minlength=n * span).reshape(n, span)
+        present = counts.max(axis=1) > 0
+        majority[present] = counts[present].argmax(axis=1) + low
+        return majority
+
+    pairs, counts = np.unique(np.column_stack([labels, values]), axis=0, return_counts=True)
+    # Pro každý pozemek nejčastější hodnota, při shodě nejmenší
+    order = np.lexsort((pairs[:, 1], -counts, pairs[:, 0]))
+    pairs = pairs[order]
+    first = np.r_[True, pairs[1:, 0] != pairs[:-1, 0]]
+    majority[pairs[first, 0].astype(np.int64)] = pairs[first, 1]
+    return majority
+
+
+def _zonal_statistics(label_grid, values, nodata=None):
+    # Průměr, majorita, počet, minimum a maximum pro všechny pozemky v jednom průchodu pásmem
+    n = len(label_grid.fids)
+    pixels = np.asarray(values, dtype=np.float64).ravel()[label_grid.pixel_index]
+    valid = np.isfinite(pixels)
+    if nodata is not None:
+        valid &= pixels != nodata
+    labels = label_grid.pixel_label[valid]
+
+    count = np.bincount(labels, minlength=n)
+    total = np.bincount(labels, weights=pixels[valid], minlength=n)
+    empty = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    mean[empty] = np.nan
+
+    minimum = np.full(n, np.nan)
+    maximum = np.full(n, np.nan)
+    if len(label_grid.starts):
+        sorted_pixels = pixels[label_grid.order]
+        sorted_valid = valid[label_grid.order]
+        minimum[label_grid.segment_labels] = np.minimum.reduceat(np.where(sorted_valid, sorted_pixels, np.inf), label_grid.starts)
+        maximum[label_grid.segment_labels] = np.maximum.reduceat(np.where(sorted_valid, sorted_pixels, -np.inf), label_grid.starts)
+        minimum[empty] = np.nan
+        maximum[empty] = np.nan
+
+    return {
+        'mean': mean,
+        'majority': _majority(labels, pixels[valid], n),
+        'count': count,
+        'min': minimum,
+        'max': maximum,
+    }
+
+
+@sucho_timing.timed('zonal_stats')
+def zonal_statistics(label_grid, values, nodata=None):
+    return _zonal_statistics(label_grid, values, nodata)
+
+
+def raster_statistics(label_grid, raster_path, band_number=1):
+    values, nodata = read_window(raster_path, label_grid.window, band_number)
+    return zonal_statistics(label_grid, values, nodata)
+
+
+def _window_pixels(window):
+    return window[2] * window[3]
+
+
+def iter_parcel_grids(mem_layer, fids, grid):
+    # Mřížka pro každý pozemek zvlášť v okně jeho obálky; pozemky mimo rastr se vynechají
+    single_ds = ogr.GetDriverByName('Memory').CreateDataSource('parcel')
+    single_layer = single_ds.CreateLayer('parcel', srs=mem_layer.GetSpatialRef(), geom_type=ogr.wkbUnknown)
+    single_layer.CreateField(ogr.FieldDefn(LABEL_FIELD, ogr.OFTInteger))
+
+    mem_layer.ResetReading()
+    for feature in mem_layer:
+        label = feature.GetField(LABEL_FIELD) - 1
+        geom = feature.GetGeometryRef()
+        window = extent_window(geom.GetEnvelope(), grid['geotransform'], grid['xsize'], grid['ysize'])
+        if _window_pixels(window) == 0:
+            continue
+        for old in list(single_layer):
+            single_layer.DeleteFeature(old.GetFID())
+        out = ogr.Feature(single_layer.GetLayerDefn())
+        out.SetGeometry(geom)
+        out.SetField(LABEL_FIELD, 1)
+        single_layer.CreateFeature(out)
+
+        labels = _rasterize(single_layer, grid, window, [])
+        if not labels.any():
+            labels = _rasterize(single_layer, grid, window, ['ALL_TOUCHED=TRUE'])
+        pixel_index = np.flatnonzero(labels)
+        yield label, _finish_grid(fids[label:label + 1], window, pixel_index, np.zeros(len(pixel_index), np.int32))
+
+
+@sucho_timing.timed('parcel_statistics')
+def parcel_statistics(shapefile_path, raster_path, band_number=1):
+    # Statistiky pozemků čtením jen těch částí rastru, které pozemky pokrývají: jedno okno přes
+    # rozsah vrstvy, nebo při rozptýlených pozemcích okno obálky každého pozemku zvlášť
+    grid = raster_grid(raster_path)
+    mem_ds, mem_layer, fids = _label_layer(shapefile_path, grid)
+    extent = extent_window(mem_layer.GetExtent(), grid['geotransform'], grid['xsize'], grid['ysize'])
+    parcel_pixels = sum(
+        _window_pixels(extent_window(feature.GetGeometryRef().GetEnvelope(), grid['geotransform'], grid['xsize'], grid['ysize']))
+        for feature in mem_layer
+    )
+    if _window_pixels(extent) <= PARCEL_WINDOW_RATIO * parcel_pixels:
+        logger.info(f"Čtení rastru v okně přes rozsah pozemků {extent}")
+        return raster_statistics(build_label_grid(shapefile_path, grid), raster_path, band_number)
+
+    logger.info(f"Čtení rastru po oknech pozemků: {parcel_pixels} pixelů místo {_window_pixels(extent)}")
+    ds = gdal.Open(raster_path)
+    band = ds.GetRasterBand(band_number)
+    nodata = band.GetNoDataValue()
+    n = len(fids)
+    result = {name: np.full(n, np.nan) for name in ('mean', 'majority', 'min', 'max')}
+    result['count'] = np.zeros(n, dtype=np.int64)
+    for label, label_grid in iter_parcel_grids(mem_layer, fids, grid):
+        # Bez úseku sucho_timing pro každý pozemek, měří se celé parcel_statistics
+        stats = _zonal_statistics(label_grid, band.ReadAsArray(*label_grid.window), nodata)
+        for name, values in stats.items():
+            result[name][label] = values[0]
+    return result
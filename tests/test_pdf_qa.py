@@ -0,0 +1,113 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_qa
+
+SEGMENTS = [
+    ("Title", "Soil drought in Bohemia"),
+    ("Text", "author smith university prague " * 5),
+    ("Title", "Methods"),
+    ("Text", "soil moisture was measured with sensors " * 60),
+    ("Title", "Results"),
+    ("Text", "drought increased in the south " * 60),
+]
+QUESTIONS = {
+    "Authors": "who is the author",
+    "Affiliation": "which university",
+    "Methods": "how was soil moisture measured",
+}
+INSTRUCTIONS = "answer the question"
+
+
+def test_load_segments_uses_cache(tmp_path):
+    pdf_path = tmp_path / "article.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 test")
+    calls = []
+
+    def extract(path):
+        calls.append(path)
+        return SEGMENTS
+
+    first = pdf_qa.load_segments(str(pdf_path), extract, str(tmp_path / "cache"))
+    second = pdf_qa.load_segments(str(pdf_path), extract, str(tmp_path / "cache"))
+    assert first == second == SEGMENTS
+    assert len(calls) == 1
+
+
+def test_chunk_index_ranks_matching_chunks():
+    chunks = pdf_qa.split_chunks(SEGMENTS, max_words=50)
+    assert all(chunk.startswith("Title: ") for chunk in chunks)
+    index = pdf_qa.ChunkIndex(chunks)
+    assert "smith" in chunks[index.search("author smith", 1)[0]]
+    assert "sensors" in chunks[index.search("sensors", 1)[0]]
+    assert index.search("unrelated words", 3) == []
+
+
+@pytest.fixture(scope="module")
+def tiny_tokenizer():
+    pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    from tokenizers import Tokenizer, models, pre_tokenizers
+
+    words = sorted({word for text in [INSTRUCTIONS, "Title Context Question Answer"] + list(QUESTIONS.values())
+                    + [text for _, text in SEGMENTS] for word in pdf_qa.tokenize(text)})
+    vocab = {token: i for i, token in enumerate(["[UNK]", "[EOS]"] + words + [":", "?", ".", ","])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", eos_token="[EOS]")
+
+
+def tiny_models(vocab_size):
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel, LlamaConfig, LlamaForCausalLM
+
+    # Větší rozptyl náhodných vah, aby odpovědi nezdegenerovaly na jeden opakovaný token
+    torch.manual_seed(0)
+    yield GPT2LMHeadModel(GPT2Config(vocab_size=vocab_size, n_embd=32, n_layer=2, n_head=2, n_positions=1024,
+                                     bos_token_id=1, eos_token_id=1, initializer_range=0.2))
+    yield LlamaForCausalLM(LlamaConfig(vocab_size=vocab_size, hidden_size=32, intermediate_size=64,
+                                       num_hidden_layers=2, num_attention_heads=2, num_key_value_heads=1,
+                                       max_position_embeddings=1024, bos_token_id=1, eos_token_id=1,
+                                       initializer_range=0.2))
+
+
+def uncached_answers(qa, questions):
+    # Reference: celý prompt (prefix + otázka) pro každou otázku zvlášť, bez sdílené cache
+    import torch
+
+    chunks = pdf_qa.split_chunks(SEGMENTS, qa.chunk_words)
+    prefix = qa.build_prefix(INSTRUCTIONS, qa.select_context(chunks, list(questions.values())))
+    prefix_ids = qa.tokenizer(prefix, return_tensors='pt')['input_ids']
+    answers = {}
+    for key, question in questions.items():
+        question_ids = qa.tokenizer(qa.build_question(question), add_special_tokens=False, return_tensors='pt')['input_ids']
+        input_ids = torch.cat([prefix_ids, question_ids], dim=1)
+        outputs = qa.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                    max_new_tokens=qa.max_new_tokens, do_sample=False,
+                                    pad_token_id=qa.tokenizer.eos_token_id)
+        answer = qa.tokenizer.decode(outputs[0, input_ids.shape[1]:], skip_special_tokens=True)
+        answers[key] = answer.strip().split("\n")[0]
+    return answers
+
+
+def test_prefix_cache_matches_uncached_generation(tiny_tokenizer):
+    for model in tiny_models(len(tiny_tokenizer)):
+        model.eval()
+        qa = pdf_qa.DocumentQA(tiny_tokenizer, model, max_context_tokens=200, max_new_tokens=6, chunk_words=40)
+        answers = qa.answer(SEGMENTS, QUESTIONS, INSTRUCTIONS)
+        # Každá další otázka by bez oříznutí cache navazovala na předchozí otázku a odpověď
+        assert answers == uncached_answers(qa, QUESTIONS)
+        assert len(set(answers.values())) > 1
+
+
+def test_answer_documents(tiny_tokenizer):
+    model = next(tiny_models(len(tiny_tokenizer)))
+    model.eval()
+    qa = pdf_qa.DocumentQA(tiny_tokenizer, model, max_context_tokens=200, max_new_tokens=4, chunk_words=40)
+    all_answers = pdf_qa.answer_documents({"a.pdf": SEGMENTS, "b.pdf": SEGMENTS[:2]}, QUESTIONS, qa, INSTRUCTIONS)
+    assert list(all_answers) == ["a.pdf", "b.pdf"]
+    assert all(set(answers) == set(QUESTIONS) for answers in all_answers.values())
@@ -0,0 +1,118 @@
+import os
+import sys
+import logging
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+gdal = pytest.importorskip("osgeo.gdal")
+
+import sucho_bench
+import sucho_zonal
+
+N_PARCELS = 30
+N_DATES = 2
+PARCEL_PIXELS = sucho_bench.PARCEL_PIXELS * sucho_bench.PARCEL_PIXELS
+# Třídy v pozemku: MAJORITY_PIXELS pixelů třídy a, zbytek třídy b
+MAJORITY_PIXELS = 10
+
+
+@pytest.fixture(scope="module")
+def rasters(tmp_path_factory):
+    # Syntetické GeoTIFF z sucho_bench: každý pixel pozemku má hodnotu pozemku, část pozemků je nodata
+    folder = str(tmp_path_factory.mktemp("rastry"))
+    shapefile_path, raster_paths, values = sucho_bench.write_rasters(folder, N_PARCELS, N_DATES)
+    return shapefile_path, raster_paths, values
+
+
+@pytest.fixture(scope="module")
+def class_raster(rasters, tmp_path_factory):
+    # Rastr tříd na stejné mřížce: v každém pozemku MAJORITY_PIXELS pixelů třídy a, zbytek třídy b
+    _, raster_paths, _ = rasters
+    source = gdal.Open(raster_paths[0])
+    xsize, ysize = source.RasterXSize, source.RasterYSize
+    size = sucho_bench.PARCEL_PIXELS
+    columns = xsize // size
+
+    rng = np.random.default_rng(0)
+    majority = rng.integers(0, 6, N_PARCELS)
+    minority = (majority + rng.integers(1, 5, N_PARCELS)) % 6
+    pixels = np.full((ysize, xsize), sucho_bench.NODATA, dtype=np.float32)
+    pattern = np.arange(PARCEL_PIXELS).reshape(size, size) < MAJORITY_PIXELS
+    for i in range(N_PARCELS):
+        row, column = divmod(i, columns)
+        pixels[row * size:(row + 1) * size, column * size:(column + 1) * size] = np.where(pattern, majority[i], minority[i])
+
+    path = os.path.join(str(tmp_path_factory.mktemp("tridy")), "SUCHO_tridy.tif")
+    target = gdal.GetDriverByName("GTiff").Create(path, xsize, ysize, 1, gdal.GDT_Float32)
+    target.SetGeoTransform(source.GetGeoTransform())
+    target.SetProjection(source.GetProjection())
+    band = target.GetRasterBand(1)
+    band.SetNoDataValue(sucho_bench.NODATA)
+    band.WriteArray(pixels)
+    target = None
+    expected_mean = (MAJORITY_PIXELS * majority + (PARCEL_PIXELS - MAJORITY_PIXELS) * minority) / PARCEL_PIXELS
+    return path, majority.astype(np.float64), expected_mean
+
+
+def assert_synthetic_stats(stats, expected):
+    # Hodnota pozemku je ve všech jeho pixelech, rastr je float32
+    expected = expected.astype(np.float32).astype(np.float64)
+    missing = np.isnan(expected)
+    np.testing.assert_array_equal(stats['count'], np.where(missing, 0, PARCEL_PIXELS))
+    np.testing.assert_allclose(stats['mean'], expected, equal_nan=True)
+    np.testing.assert_allclose(stats['majority'], expected, equal_nan=True)
+    np.testing.assert_allclose(stats['min'], expected, equal_nan=True)
+    np.testing.assert_allclose(stats['max'], expected, equal_nan=True)
+
+
+def test_raster_statistics(rasters):
+    shapefile_path, raster_paths, values = rasters
+    label_grid = sucho_zonal.build_label_grid(shapefile_path, sucho_zonal.raster_grid(raster_paths[0]))
+    assert len(label_grid.fids) == N_PARCELS
+    for j, raster_path in enumerate(raster_paths):
+        assert_synthetic_stats(sucho_zonal.raster_statistics(label_grid, raster_path), values[:, j])
+
+
+def test_raster_statistics_majority(rasters, class_raster):
+    shapefile_path, _, _ = rasters
+    path, majority, mean = class_raster
+    label_grid = sucho_zonal.build_label_grid(shapefile_path, sucho_zonal.raster_grid(path))
+    stats = sucho_zonal.raster_statistics(label_grid, path)
+    np.testing.assert_array_equal(stats['count'], np.full(N_PARCELS, PARCEL_PIXELS))
+    np.testing.assert_array_equal(stats['majority'], majority)
+    np.testing.assert_allclose(stats['mean'], mean)
+
+
+def test_label_grid_cache(rasters, tmp_path):
+    shapefile_path, raster_paths, values = rasters
+    grid = sucho_zonal.raster_grid(raster_paths[0])
+    built = sucho_zonal.load_label_grid(shapefile_path, grid, str(tmp_path))
+    assert len(os.listdir(str(tmp_path))) == 1
+    cached = sucho_zonal.load_label_grid(shapefile_path, grid, str(tmp_path))
+    assert cached.window == built.window
+    for name in ('fids', 'pixel_index', 'pixel_label', 'order', 'starts', 'segment_labels'):
+        np.testing.assert_array_equal(getattr(cached, name), getattr(built, name))
+    assert_synthetic_stats(sucho_zonal.raster_statistics(cached, raster_paths[1]), values[:, 1])
+
+
+@pytest.mark.parametrize("ratio, message", [
+    (10 ** 6, "okně přes rozsah pozemků"),
+    (0, "po oknech pozemků"),
+])
+def test_parcel_statistics_branches(rasters, class_raster, monkeypatch, caplog, ratio, message):
+    # Velký poměr vynutí jedno okno přes rozsah vrstvy, nulový čtení okna každého pozemku zvlášť
+    shapefile_path, raster_paths, values = rasters
+    monkeypatch.setattr(sucho_zonal, 'PARCEL_WINDOW_RATIO', ratio)
+    with caplog.at_level(logging.INFO, logger=sucho_zonal.__name__):
+        stats = sucho_zonal.parcel_statistics(shapefile_path, raster_paths[0])
+    assert message in caplog.text
+    assert_synthetic_stats(stats, values[:, 0])
+
+    path, majority, mean = class_raster
+    stats = sucho_zonal.parcel_statistics(shapefile_path, path)
+    np.testing.assert_array_equal(stats['count'], np.full(N_PARCELS, PARCEL_PIXELS))
+    np.testing.assert_array_equal(stats['majority'], majority)
+    np.testing.assert_allclose(stats['mean'], mean)